@@ -1,14 +1,27 @@
-from flask import Flask, render_template, redirect, url_for, flash, request
+from flask import Flask, render_template, redirect, url_for, flash, request, jsonify, abort, session, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
-from werkzeug.security import generate_password_hash, check_password_hash
 import os
+from functools import wraps
 from datetime import datetime, timedelta
-from crypto_utils import encrypt_data, decrypt_data
+from crypto_utils import encrypt_data, decrypt_data, decrypt_with_status, email_blind_index
+from db_types import Ciphertext, EncryptedString
+from write_behind import WriteBehindBuffer
+from password_hashing import HashingService, HashingBusy
+from password_policy import PasswordPolicy
+from throttling import LoginThrottle, MemoryThrottleStore, SQLiteThrottleStore
+from ttl_cache import TTLCache
+from sqlite_profile import apply_sqlite_profile
+from db_routing import RoutingSession, replica_binds, replica_reads
+from export_users import export_lines
 from sqlalchemy.ext.hybrid import hybrid_property
+from sqlalchemy import and_, bindparam, event, or_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import object_session
+from sqlalchemy.dialects import postgresql, sqlite
 # from flask_caching import Cache
 # from flask_assets import Environment, Bundle
-from flask_mail import Mail, Message
+from flask_mail import Mail
 # from flask_wtf import FlaskForm
 # from wtforms import StringField, PasswordField, SubmitField, BooleanField, TextAreaField
 # from wtforms.validators import DataRequired, Length, Email, EqualTo, ValidationError
@@ -21,21 +34,76 @@ import hashlib
 app = Flask(__name__)
 # Use environment variable for secret key, or generate a consistent one
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY') or 'dev-secret-key-change-in-production'
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///database.db'
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL') or 'sqlite:///database.db'
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# Read replicas for read-only lookups, as comma-separated database URLs
+app.config['SQLALCHEMY_BINDS'] = replica_binds(
+    [url.strip() for url in os.environ.get('DATABASE_REPLICA_URLS', '').split(',') if url.strip()]
+)
+# Connection pool settings, applied to the primary and every replica
+engine_options = {}
+if os.environ.get('DATABASE_POOL_SIZE'):
+    engine_options['pool_size'] = int(os.environ['DATABASE_POOL_SIZE'])
+if os.environ.get('DATABASE_MAX_OVERFLOW'):
+    engine_options['max_overflow'] = int(os.environ['DATABASE_MAX_OVERFLOW'])
+if os.environ.get('DATABASE_POOL_RECYCLE'):
+    engine_options['pool_recycle'] = int(os.environ['DATABASE_POOL_RECYCLE'])
+engine_options['pool_pre_ping'] = os.environ.get('DATABASE_POOL_PRE_PING', 'false').lower() in ('1', 'true', 'yes')
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options
+# 'production' applies WAL, mmap, busy_timeout and related PRAGMAs to SQLite connections
+app.config['SQLITE_PROFILE'] = os.environ.get('SQLITE_PROFILE', 'production')
 
 # CSRF Protection
 # app.config['WTF_CSRF_ENABLED'] = True
 # app.config['WTF_CSRF_TIME_LIMIT'] = 3600  # 1 hour
 
 # Email configuration
-app.config['MAIL_SERVER'] = 'smtp.gmail.com'
-app.config['MAIL_PORT'] = 587
-app.config['MAIL_USE_TLS'] = True
+app.config['MAIL_SERVER'] = os.environ.get('MAIL_SERVER', 'smtp.gmail.com')
+app.config['MAIL_PORT'] = int(os.environ.get('MAIL_PORT', 587))
+app.config['MAIL_USE_TLS'] = os.environ.get('MAIL_USE_TLS', 'true').lower() in ('1', 'true', 'yes')
 app.config['MAIL_USERNAME'] = os.environ.get('EMAIL_USER', '')
 app.config['MAIL_PASSWORD'] = os.environ.get('EMAIL_PASS', '')
 mail = Mail(app)
 
+# Password hashing pool; HASHING_WORKERS=0 hashes on the request thread
+app.config['HASHING_WORKERS'] = int(os.environ['HASHING_WORKERS']) if os.environ.get('HASHING_WORKERS') else None
+app.config['HASHING_MAX_QUEUE'] = int(os.environ['HASHING_MAX_QUEUE']) if os.environ.get('HASHING_MAX_QUEUE') else None
+hashing = HashingService(workers=app.config['HASHING_WORKERS'], max_queue=app.config['HASHING_MAX_QUEUE'])
+
+# Algorithm and cost for new password hashes, e.g. 'pbkdf2:sha256:600000' or 'scrypt:32768:8:1'.
+# Older hashes are upgraded on the next successful login.
+app.config['PASSWORD_HASH_METHOD'] = os.environ.get('PASSWORD_HASH_METHOD', 'pbkdf2:sha256')
+password_policy = PasswordPolicy(app.config['PASSWORD_HASH_METHOD'])
+
+# Login throttling; set LOGIN_THROTTLE_DB to a SQLite file path to share counters between workers
+app.config['LOGIN_THROTTLE_DB'] = os.environ.get('LOGIN_THROTTLE_DB', '')
+app.config['LOGIN_MAX_ATTEMPTS'] = int(os.environ.get('LOGIN_MAX_ATTEMPTS', 5))
+app.config['LOGIN_MAX_ATTEMPTS_PER_IP'] = int(os.environ.get('LOGIN_MAX_ATTEMPTS_PER_IP', 50))
+app.config['LOGIN_THROTTLE_WINDOW'] = int(os.environ.get('LOGIN_THROTTLE_WINDOW', 300))
+login_throttle = LoginThrottle(
+    SQLiteThrottleStore(app.config['LOGIN_THROTTLE_DB']) if app.config['LOGIN_THROTTLE_DB'] else MemoryThrottleStore(),
+    max_attempts=app.config['LOGIN_MAX_ATTEMPTS'],
+    max_attempts_per_ip=app.config['LOGIN_MAX_ATTEMPTS_PER_IP'],
+    window=app.config['LOGIN_THROTTLE_WINDOW'],
+)
+
+# Per-process cache for the Flask-Login user loader
+app.config['USER_CACHE_SIZE'] = int(os.environ.get('USER_CACHE_SIZE', 1024))
+app.config['USER_CACHE_TTL'] = float(os.environ.get('USER_CACHE_TTL', 60))
+user_cache = TTLCache(maxsize=app.config['USER_CACHE_SIZE'], ttl=app.config['USER_CACHE_TTL'])
+
+# Optional stateless mode: keep a signed identity claim in the session so display-only pages needn't load the user
+app.config['IDENTITY_CLAIM_ENABLED'] = os.environ.get('IDENTITY_CLAIM_ENABLED', '').lower() in ('1', 'true', 'yes')
+app.config['IDENTITY_CLAIM_TTL'] = int(os.environ.get('IDENTITY_CLAIM_TTL', 900))
+IDENTITY_CLAIM_VERSION = 1
+
+# Login and security events are buffered in memory and written in batches
+app.config['SECURITY_EVENT_BATCH_SIZE'] = int(os.environ.get('SECURITY_EVENT_BATCH_SIZE', 100))
+app.config['SECURITY_EVENT_FLUSH_INTERVAL'] = float(os.environ.get('SECURITY_EVENT_FLUSH_INTERVAL', 2.0))
+
+# Usernames allowed to use admin-only endpoints
+app.config['ADMIN_USERNAMES'] = [name.strip() for name in os.environ.get('ADMIN_USERNAMES', '').split(',') if name.strip()]
+
 # Define Forms - commented out due to missing dependencies
 # class LoginForm(FlaskForm):
 #     username_or_email = StringField('Username or Email', validators=[DataRequired()])
@@ -107,7 +175,12 @@ mail = Mail(app)
 # assets.register('js_all', js)
 
 # Initialize SQLAlchemy
-db = SQLAlchemy(app)
+db = SQLAlchemy(app, session_options={'class_': RoutingSession})
+
+if app.config['SQLITE_PROFILE'] == 'production':
+    with app.app_context():
+        for engine in db.engines.values():
+            apply_sqlite_profile(engine)
 
 # Initialize Login Manager
 login_manager = LoginManager()
@@ -123,35 +196,62 @@ def inject_now():
 class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(80), unique=True, nullable=False, index=True)
-    _email = db.Column('email', db.String(255), unique=True, nullable=False, index=True)
+    # Compact binary ciphertext; legacy base64 strings are still read until converted
+    _email = db.Column('email', Ciphertext, unique=True, nullable=False, index=True)
+    # Deterministic HMAC of the normalized email, used for lookups since Fernet output is randomized
+    email_index = db.Column(db.String(64), unique=True, nullable=True, index=True)
     password = db.Column(db.String(200), nullable=False)
     registered_on = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+    # Bumped whenever credentials change so identity claims issued before that are rejected
+    credential_version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     
     @hybrid_property
     def email(self):
-        """Decrypt email when accessing the property"""
+        """Decrypt email when accessing the property, memoized per instance"""
         if self._email is None:
             return None
-        return decrypt_data(self._email)
+        # The cache is keyed by the ciphertext so direct writes to _email invalidate it
+        cached = self.__dict__.get('_email_cache')
+        if cached is not None and cached[0] == self._email:
+            return cached[1]
+        plain_email, stale = decrypt_with_status(self._email)
+        if stale and self.id is not None:
+            # Encrypted with an older key: re-encrypt under the primary key in a deferred batch
+            email_rotation_buffer.add({
+                'user_id': self.id,
+                'old_email': self._email,
+                'new_email': encrypt_data(plain_email, compact=True),
+            })
+        self.__dict__['_email_cache'] = (self._email, plain_email)
+        return plain_email
+    
+    @email.expression
+    def email(cls):
+        """Class-level access refers to the stored (encrypted) column"""
+        return cls._email
     
     @email.setter
     def email(self, value):
         """Encrypt email when setting the property"""
         if value is None:
             self._email = None
+            self.email_index = None
+            self.__dict__.pop('_email_cache', None)
         else:
-            self._email = encrypt_data(value)
+            self._email = encrypt_data(value, compact=True)
+            self.email_index = email_blind_index(value)
+            self.__dict__['_email_cache'] = (self._email, value)
         
     # Helper method to find a user by email
     @classmethod
     def find_by_email(cls, email):
-        """Find a user by their email by checking against encrypted values"""
+        """Find a user by their email using the blind index"""
         if not email:
             return None
         try:
-            encrypted_email = encrypt_data(email)
-            # Query directly against the encrypted value
-            return cls.query.filter(cls._email == encrypted_email).first()
+            # Single indexed equality lookup against the keyed HMAC of the email
+            with replica_reads(db.session):
+                return cls.query.filter(cls.email_index == email_blind_index(email)).first()
         except Exception as e:
             print(f"Error in find_by_email: {e}")
             return None
@@ -193,27 +293,400 @@ class User(UserMixin, db.Model):
                 return None
             
             # Find and return user
-            return User.query.get(int(user_id))
+            with replica_reads(db.session):
+                return db.session.get(User, int(user_id))
             
         except (ValueError, TypeError):
             return None
 
+# Outgoing email queued by requests and delivered by mail_worker.py
+class OutboxMessage(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    subject = db.Column(db.String(255), nullable=False)
+    sender = db.Column(db.String(255), nullable=False)
+    # Comma-separated; encrypted because they are user email addresses
+    recipients = db.Column(EncryptedString, nullable=False)
+    # Encrypted since it may contain reset links; cleared once delivered
+    body = db.Column(EncryptedString, nullable=True)
+    status = db.Column(db.String(20), nullable=False, default='pending')
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    last_error = db.Column(db.String(255), nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime, nullable=True)
+
+    __table_args__ = (
+        # The delivery worker polls for due pending messages
+        db.Index('ix_outbox_message_status_next_attempt', 'status', 'next_attempt_at'),
+    )
+
+def queue_email(subject, recipients, body, sender='noreply@auth-system.com'):
+    """Add a message to the outbox; it is committed with the caller's transaction"""
+    message = OutboxMessage(subject=subject, sender=sender, recipients=','.join(recipients), body=body)
+    db.session.add(message)
+    return message
+
+class SignupDaily(db.Model):
+    """Registrations per UTC day, kept up to date as users are inserted"""
+    day = db.Column(db.Date, primary_key=True)
+    signups = db.Column(db.Integer, nullable=False, default=0)
+
+class SignupHourly(db.Model):
+    """Registrations per UTC hour; `hour` is registered_on truncated to the hour"""
+    hour = db.Column(db.DateTime, primary_key=True)
+    signups = db.Column(db.Integer, nullable=False, default=0)
+
+def _increment_rollup(connection, table, key, counts):
+    """Add counts ({bucket: n}) to a rollup table, creating missing buckets"""
+    dialect = connection.dialect.name
+    for bucket, count in counts.items():
+        if dialect in ('sqlite', 'postgresql'):
+            # Single-statement upsert, so concurrent first signups in a bucket can't collide
+            insert = sqlite.insert if dialect == 'sqlite' else postgresql.insert
+            statement = insert(table).values({key: bucket, 'signups': count})
+            connection.execute(statement.on_conflict_do_update(
+                index_elements=[key], set_={'signups': table.c.signups + statement.excluded.signups}))
+        else:
+            result = connection.execute(table.update().where(table.c[key] == bucket).values(signups=table.c.signups + count))
+            if result.rowcount == 0:
+                connection.execute(table.insert().values({key: bucket, 'signups': count}))
+
+def record_signups(connection, timestamps):
+    """Count registrations at the given times into the daily and hourly rollups, in the caller's transaction"""
+    daily, hourly = {}, {}
+    for timestamp in timestamps:
+        day = timestamp.date()
+        hour = timestamp.replace(minute=0, second=0, microsecond=0)
+        daily[day] = daily.get(day, 0) + 1
+        hourly[hour] = hourly.get(hour, 0) + 1
+    _increment_rollup(connection, SignupDaily.__table__, 'day', daily)
+    _increment_rollup(connection, SignupHourly.__table__, 'hour', hourly)
+
+class SecurityEvent(db.Model):
+    """A login or account security event shown in the activity panels; written in batches"""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, nullable=False)
+    event_type = db.Column(db.String(32), nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    ip_address = db.Column(db.String(45), nullable=True)
+    user_agent = db.Column(db.String(255), nullable=True)
+
+    __table_args__ = (
+        # Activity panels read a user's newest events first, paging by (created_at, id)
+        db.Index('ix_security_event_user_created', 'user_id', 'created_at'),
+    )
+
+# Display label, colour and icon for each event type
+SECURITY_EVENT_TYPES = {
+    'login': ('Successful login', 'primary', 'fa-sign-in-alt'),
+    'login_failed': ('Failed login attempt', 'danger', 'fa-exclamation-triangle'),
+    'logout': ('Logged out', 'info', 'fa-sign-out-alt'),
+    'registered': ('Account created', 'success', 'fa-user-plus'),
+    'password_reset_requested': ('Password reset requested', 'info', 'fa-envelope'),
+    'password_changed': ('Password changed', 'warning', 'fa-key'),
+}
+
+class CurrentUser:
+    """
+    Immutable, slotted snapshot of the logged-in user returned by the user loader.
+
+    Holds only what pages display, so requests don't carry a session-bound
+    ORM instance. Routes that change the user should call get_model() to
+    load the real User row.
+    """
+    __slots__ = ('id', 'username', 'email', 'credential_version')
+
+    # Flask-Login user interface
+    is_authenticated = True
+    is_active = True
+    is_anonymous = False
+
+    def __init__(self, id, username, email, credential_version=0):
+        object.__setattr__(self, 'id', id)
+        object.__setattr__(self, 'username', username)
+        object.__setattr__(self, 'email', email)
+        object.__setattr__(self, 'credential_version', credential_version)
+
+    @classmethod
+    def from_model(cls, user):
+        """Snapshot a User, decrypting the email once"""
+        return cls(user.id, user.username, user.email, user.credential_version or 0)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} is read-only; use get_model() to change the user")
+
+    def get_id(self):
+        return str(self.id)
+
+    def get_model(self):
+        """Load the User row for routes that need to modify it"""
+        return db.session.get(User, self.id)
+
+    def __eq__(self, other):
+        if isinstance(other, (CurrentUser, User)):
+            return self.get_id() == other.get_id()
+        return NotImplemented
+
+    def __hash__(self):
+        return hash(self.id)
+
+def flush_email_rotations(rows):
+    """Write re-encrypted emails back in one executemany, skipping rows changed since they were read"""
+    user_table = User.__table__
+    statement = user_table.update().where(
+        user_table.c.id == bindparam('user_id'),
+        user_table.c.email == bindparam('old_email'),
+    ).values(email=bindparam('new_email'))
+    with app.app_context():
+        db.session.execute(statement, rows)
+        db.session.commit()
+
+# Deferred write-behind for rows that were read with an old encryption key
+email_rotation_buffer = WriteBehindBuffer(flush_email_rotations, batch_size=100, interval=5.0, name='email-rotation')
+
+def flush_password_rehashes(items):
+    """Hash queued passwords under the current policy and store them, skipping hashes changed since login"""
+    rows = []
+    for item in items:
+        try:
+            new_hash = hashing.generate(item['password'], method=password_policy.method, salt_length=password_policy.salt_length)
+        except HashingBusy:
+            # Leave it for the user's next login rather than competing with live traffic
+            continue
+        rows.append({'user_id': item['user_id'], 'old_password': item['old_password'], 'new_password': new_hash})
+    if not rows:
+        return
+    user_table = User.__table__
+    statement = user_table.update().where(
+        user_table.c.id == bindparam('user_id'),
+        user_table.c.password == bindparam('old_password'),
+    ).values(password=bindparam('new_password'))
+    with app.app_context():
+        db.session.execute(statement, rows)
+        db.session.commit()
+    for row in rows:
+        user_cache.invalidate(row['user_id'])
+
+# Deferred upgrade of password hashes made under an older policy; plaintexts are held only until the next flush
+password_rehash_buffer = WriteBehindBuffer(flush_password_rehashes, batch_size=20, interval=2.0, max_pending=1000, name='password-rehash')
+
+def flush_security_events(events):
+    """Insert buffered security events in one executemany"""
+    with app.app_context():
+        db.session.execute(SecurityEvent.__table__.insert(), events)
+        db.session.commit()
+
+# Ring buffer of security events so logins don't each need a write transaction
+security_event_buffer = WriteBehindBuffer(
+    flush_security_events,
+    batch_size=app.config['SECURITY_EVENT_BATCH_SIZE'],
+    interval=app.config['SECURITY_EVENT_FLUSH_INTERVAL'],
+    name='security-events',
+)
+
+def record_security_event(user_id, event_type):
+    """Queue a security event for the current request's client"""
+    security_event_buffer.add({
+        'user_id': user_id,
+        'event_type': event_type,
+        'created_at': datetime.utcnow(),
+        'ip_address': request.remote_addr,
+        'user_agent': request.user_agent.string[:255] or None,
+    })
+
+def describe_user_agent(user_agent):
+    """Short 'Browser on OS' description of a User-Agent header"""
+    if not user_agent:
+        return 'Unknown device'
+    # Order matters: Edge and Opera also claim Chrome, Chrome also claims Safari
+    browsers = (('Edg/', 'Edge'), ('OPR/', 'Opera'), ('Firefox/', 'Firefox'), ('Chrome/', 'Chrome'), ('Safari/', 'Safari'))
+    systems = (('iPhone', 'iPhone'), ('iPad', 'iPad'), ('Android', 'Android'), ('Windows', 'Windows'),
+               ('Mac OS X', 'macOS'), ('Linux', 'Linux'))
+    browser = next((name for token, name in browsers if token in user_agent), None)
+    system = next((name for token, name in systems if token in user_agent), None)
+    if browser and system:
+        return f"{browser} on {system}"
+    return browser or system or user_agent.split('/', 1)[0][:40]
+
+def describe_security_event(event):
+    """Add display fields to an event dict for the templates"""
+    label, color, icon = SECURITY_EVENT_TYPES.get(event['event_type'], (event['event_type'], 'info', 'fa-info-circle'))
+    return dict(event, label=label, color=color, icon=icon, device=describe_user_agent(event['user_agent']))
+
+def security_events_for(user_id, limit=5, before=None, event_types=None, include_pending=False):
+    """
+    Return a user's newest security events, newest first, as dicts.
+
+    Pages are keyset-paginated on the (user_id, created_at) index: before is
+    the (created_at, id) of the last event already shown. include_pending
+    also merges this process's not-yet-flushed events, so a panel shows a
+    login that just happened.
+    """
+    table = SecurityEvent.__table__
+    query = db.session.query(
+        table.c.id, table.c.event_type, table.c.created_at, table.c.ip_address, table.c.user_agent
+    ).filter(table.c.user_id == user_id)
+    if event_types:
+        query = query.filter(table.c.event_type.in_(event_types))
+    if before:
+        created_at, event_id = before
+        query = query.filter(or_(table.c.created_at < created_at,
+                                 and_(table.c.created_at == created_at, table.c.id < event_id)))
+    with replica_reads(db.session):
+        events = [row._asdict() for row in
+                  query.order_by(table.c.created_at.desc(), table.c.id.desc()).limit(limit).all()]
+
+    if include_pending:
+        pending = [dict(event, id=None) for event in security_event_buffer.pending_items()
+                   if event['user_id'] == user_id and (not event_types or event['event_type'] in event_types)]
+        events = sorted(pending + events, key=lambda event: event['created_at'], reverse=True)[:limit]
+    return events
+
+@app.template_filter('timeago')
+def timeago(value):
+    """Render a UTC datetime as e.g. 'Just now', '5 minutes ago' or '3 days ago'"""
+    seconds = int((datetime.utcnow() - value).total_seconds())
+    if seconds < 60:
+        return 'Just now'
+    for unit, size in (('day', 86400), ('hour', 3600), ('minute', 60)):
+        if seconds >= size:
+            count = seconds // size
+            return f"{count} {unit}{'s' if count != 1 else ''} ago"
+
+def issue_identity_claim(user):
+    """Store a signed identity claim with the user's display fields in the session (email encrypted)"""
+    if not app.config['IDENTITY_CLAIM_ENABLED']:
+        return
+    session['identity'] = {
+        'v': IDENTITY_CLAIM_VERSION,
+        'id': user.id,
+        'username': user.username,
+        'email': encrypt_data(user.email, compact=True),
+        'cv': user.credential_version or 0,
+        'exp': int(time.time()) + app.config['IDENTITY_CLAIM_TTL'],
+    }
+
+def identity_from_claim(user_id):
+    """Build the current user from the session's identity claim, or None if it is missing or expired"""
+    claim = session.get('identity')
+    if (not app.config['IDENTITY_CLAIM_ENABLED'] or not claim
+            or claim.get('v') != IDENTITY_CLAIM_VERSION or claim.get('id') != user_id
+            or claim.get('exp', 0) < time.time()):
+        return None
+    return CurrentUser(user_id, claim['username'], decrypt_data(claim['email']), claim['cv'])
+
+def sensitive_route(view):
+    """
+    Check the session against the database before running a view.
+    Sessions whose credentials changed since login (e.g. after a password
+    reset) are logged out, even when pages are served from an identity claim
+    or the user cache.
+    """
+    @wraps(view)
+    def wrapped(*args, **kwargs):
+        if current_user.is_authenticated:
+            user = db.session.get(User, current_user.id)
+            session_version = session.get('credential_version', current_user.credential_version)
+            if user is None or (user.credential_version or 0) != session_version:
+                logout_user()
+                session.pop('identity', None)
+                session.pop('credential_version', None)
+                flash('Your session has expired. Please log in again.', 'info')
+                return redirect(url_for('login'))
+        return view(*args, **kwargs)
+    return wrapped
+
+def admin_required(view):
+    """Restrict a view to logged-in users listed in ADMIN_USERNAMES"""
+    @wraps(view)
+    @login_required
+    @sensitive_route
+    def wrapped(*args, **kwargs):
+        if current_user.username not in app.config['ADMIN_USERNAMES']:
+            abort(403)
+        return view(*args, **kwargs)
+    return wrapped
+
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def collect_changed_user(mapper, connection, target):
+    """Note a changed user (e.g. a password reset); it leaves the loader cache when the transaction commits"""
+    object_session(target).info.setdefault('changed_user_ids', set()).add(target.id)
+
+@event.listens_for(RoutingSession, 'after_commit')
+def invalidate_changed_users(session):
+    """Evict after the commit, since a load racing a flush-time eviction could re-cache the old row"""
+    for user_id in session.info.pop('changed_user_ids', ()):
+        user_cache.invalidate(user_id)
+
+@event.listens_for(User, 'after_insert')
+def count_signup(mapper, connection, target):
+    """Keep the signup rollups current; runs in the same transaction as the insert"""
+    record_signups(connection, [target.registered_on])
+
+def cache_user_snapshot(user_id, primary=False):
+    """Load a user (from a replica unless primary is set) and cache its snapshot; None if the user is gone"""
+    if primary:
+        user = db.session.get(User, user_id, populate_existing=True)
+    else:
+        with replica_reads(db.session):
+            user = db.session.get(User, user_id)
+    if user is None:
+        user_cache.invalidate(user_id)
+        return None
+    snapshot = CurrentUser.from_model(user)
+    user_cache.set(user_id, snapshot)
+    return snapshot
+
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
-
-# Send email for password reset
+    user_id = int(user_id)
+    snapshot = identity_from_claim(user_id)
+    if snapshot is not None:
+        return snapshot
+    session_version = session.get('credential_version')
+    snapshot = user_cache.get(user_id) or cache_user_snapshot(user_id)
+    if snapshot is not None and session_version is not None and session_version > snapshot.credential_version:
+        # Cached (or read from a replica) before a credential change made elsewhere: reload it
+        snapshot = cache_user_snapshot(user_id, primary=True)
+    if snapshot is None:
+        return None
+    if session_version is None:
+        # Sessions restored from a remember cookie start at the current version
+        session['credential_version'] = session_version = snapshot.credential_version
+    if session_version != snapshot.credential_version:
+        # The session predates a credential change: end it
+        session.pop('identity', None)
+        return None
+    issue_identity_claim(snapshot)
+    return snapshot
+
+def duplicate_user_field(error):
+    """Return 'username' or 'email' for an IntegrityError raised by a user unique index, else None"""
+    message = str(error.orig)
+    # Email uniqueness is enforced on the blind index, since ciphertexts are randomized
+    if 'email_index' in message:
+        return 'email'
+    if 'username' in message:
+        return 'username'
+    return None
+
+# Queue email for password reset; mail_worker.py delivers it
 def send_reset_email(user):
+    """Queue a password reset email; returns False if the user's email can't be decrypted"""
+    recipient = user.email
+    if recipient is None:
+        app.logger.error('Could not decrypt the email of user %s for a password reset', user.id)
+        return False
     token = user.get_reset_token()
-    msg = Message('Password Reset Request',
-                  sender='noreply@auth-system.com',
-                  recipients=[user.email])
-    msg.body = f'''To reset your password, visit the following link:
+    body = f'''To reset your password, visit the following link:
 {url_for('reset_token', token=token, _external=True)}
 
 If you did not make this request, simply ignore this email and no changes will be made.
 '''
-    mail.send(msg)
+    queue_email('Password Reset Request', [recipient], body)
+    db.session.commit()
+    return True
 
 # Routes
 @app.route('/')
@@ -240,19 +713,36 @@ def login():
         remember = bool(request.form.get('remember'))
         user = None
         
+        # Reject throttled attempts before touching the database or hashing anything
+        retry_after = login_throttle.check(input_identifier, request.remote_addr)
+        if retry_after:
+            flash(f'Too many failed login attempts. Please try again in {retry_after} seconds.', 'danger')
+            return render_template('login.html'), 429, {'Retry-After': str(retry_after)}
+        
         # Try to find user by email first
         if '@' in input_identifier:
             user = User.find_by_email(input_identifier)
         else:
             # If not an email, try to find by username
-            user = User.query.filter_by(username=input_identifier).first()
+            with replica_reads(db.session):
+                user = User.query.filter_by(username=input_identifier).first()
         
-        if user and check_password_hash(user.password, password):
+        if user and hashing.check(user.password, password):
+            if password_policy.needs_rehash(user.password):
+                password_rehash_buffer.add({'user_id': user.id, 'old_password': user.password, 'password': password})
+            login_throttle.record_success(input_identifier, request.remote_addr)
+            record_security_event(user.id, 'login')
             login_user(user, remember=remember)
+            # Sensitive routes compare this with the database, not with a cached copy of the user
+            session['credential_version'] = user.credential_version or 0
+            issue_identity_claim(user)
             next_page = request.args.get('next')
             flash('Logged in successfully!', 'success')
             return redirect(next_page) if next_page else redirect(url_for('dashboard'))
         else:
+            login_throttle.record_failure(input_identifier, request.remote_addr)
+            if user:
+                record_security_event(user.id, 'login_failed')
             flash('Login failed. Please check your username/email and password.', 'danger')
     
     return render_template('login.html')
@@ -273,19 +763,31 @@ def register():
             flash('All fields are required.', 'danger')
         elif password != confirm_password:
             flash('Passwords do not match.', 'danger')
-        elif User.query.filter_by(username=username).first():
-            flash('That username is taken. Please choose a different one.', 'danger')
-        elif User.find_by_email(email):
-            flash('That email is already registered. Please use a different one.', 'danger')
         else:
-            hashed_password = generate_password_hash(password, method='pbkdf2:sha256')
+            hashed_password = hashing.generate(password, method=password_policy.method, salt_length=password_policy.salt_length)
             new_user = User(username=username, email=email, password=hashed_password)
             
+            # Insert optimistically and let the unique indexes reject duplicates,
+            # which avoids separate lookups and the race between check and insert
             db.session.add(new_user)
-            db.session.commit()
-            
-            flash('Registration successful! Please login.', 'success')
-            return redirect(url_for('login'))
+            try:
+                # Take the id from the flush; reading it after the commit would reload the row
+                db.session.flush()
+                user_id = new_user.id
+                db.session.commit()
+            except IntegrityError as e:
+                db.session.rollback()
+                duplicate = duplicate_user_field(e)
+                if duplicate == 'email':
+                    flash('That email is already registered. Please use a different one.', 'danger')
+                elif duplicate == 'username':
+                    flash('That username is taken. Please choose a different one.', 'danger')
+                else:
+                    raise
+            else:
+                record_security_event(user_id, 'registered')
+                flash('Registration successful! Please login.', 'success')
+                return redirect(url_for('login'))
     
     return render_template('register.html')
 
@@ -297,8 +799,10 @@ def reset_request():
     if request.method == 'POST':
         email = request.form.get('email', '')
         user = User.find_by_email(email)
-        if user:
-            send_reset_email(user)
+        if user and not send_reset_email(user):
+            flash('We could not send a reset email right now. Please try again later.', 'danger')
+        elif user:
+            record_security_event(user.id, 'password_reset_requested')
             flash('An email has been sent with instructions to reset your password.', 'info')
         else:
             flash('There is no account with that email. You must register first.', 'danger')
@@ -327,9 +831,14 @@ def reset_token(token):
             flash('Passwords do not match.', 'danger')
         else:
             # Update user's password
-            hashed_password = generate_password_hash(password, method='pbkdf2:sha256')
+            hashed_password = hashing.generate(password, method=password_policy.method, salt_length=password_policy.salt_length)
+            user_id = user.id
             user.password = hashed_password
+            # Invalidate identity claims and sessions issued with the old password. The user may have
+            # been read from a lagging replica, so increment in SQL rather than from the loaded value
+            user.credential_version = User.credential_version + 1
             db.session.commit()
+            record_security_event(user_id, 'password_changed')
             flash('Your password has been updated! You can now log in.', 'success')
             return redirect(url_for('login'))
     
@@ -338,17 +847,45 @@ def reset_token(token):
 @app.route('/dashboard')
 @login_required
 def dashboard():
-    return render_template('dashboard.html')
+    events = security_events_for(current_user.id, limit=4, include_pending=True)
+    return render_template('dashboard.html', events=[describe_security_event(event) for event in events])
 
 @app.route('/profile')
 @login_required
 def profile():
-    return render_template('profile.html')
+    events = security_events_for(current_user.id, limit=3, include_pending=True)
+    return render_template('profile.html', events=[describe_security_event(event) for event in events])
 
 @app.route('/settings')
 @login_required
+@sensitive_route
 def settings():
-    return render_template('settings.html')
+    events = security_events_for(current_user.id, limit=5, event_types=('login', 'login_failed'), include_pending=True)
+    return render_template('settings.html', login_events=[describe_security_event(event) for event in events])
+
+@app.route('/account/activity')
+@login_required
+def account_activity():
+    # Older pages of the activity panels; `before` is the cursor returned with the previous page
+    before = None
+    if request.args.get('before'):
+        try:
+            created_at, event_id = request.args['before'].rsplit('|', 1)
+            before = (datetime.fromisoformat(created_at), int(event_id))
+        except ValueError:
+            abort(400)
+    limit = min(max(request.args.get('limit', 20, type=int), 1), 100)
+    events = security_events_for(current_user.id, limit=limit, before=before)
+    return jsonify({
+        'events': [{
+            'type': event['event_type'],
+            'label': event['label'],
+            'created_at': event['created_at'].isoformat(),
+            'ip_address': event['ip_address'],
+            'device': event['device'],
+        } for event in map(describe_security_event, events)],
+        'next': f"{events[-1]['created_at'].isoformat()}|{events[-1]['id']}" if len(events) == limit else None,
+    })
 
 @app.route('/about')
 def about():
@@ -378,10 +915,83 @@ def faq():
 @app.route('/logout')
 @login_required
 def logout():
+    record_security_event(current_user.id, 'logout')
     logout_user()
+    session.pop('identity', None)
+    session.pop('credential_version', None)
     flash('You have been logged out.', 'info')
     return redirect(url_for('home'))
 
+@app.route('/admin/metrics/hashing')
+@admin_required
+def hashing_metrics():
+    return jsonify(hashing.stats())
+
+@app.route('/admin/metrics/user-cache')
+@admin_required
+def user_cache_metrics():
+    return jsonify(user_cache.stats())
+
+@app.route('/admin/stats/signups')
+@admin_required
+def signup_stats():
+    # Answered from the rollup tables, so the cost depends on the range, not the number of users
+    granularity = request.args.get('granularity', 'day')
+    if granularity == 'day':
+        periods = min(max(request.args.get('days', 30, type=int), 1), 3660)
+        step = timedelta(days=1)
+        model, key = SignupDaily, SignupDaily.day
+        end = datetime.utcnow().date()
+    elif granularity == 'hour':
+        periods = min(max(request.args.get('hours', 48, type=int), 1), 24 * 92)
+        step = timedelta(hours=1)
+        model, key = SignupHourly, SignupHourly.hour
+        end = datetime.utcnow().replace(minute=0, second=0, microsecond=0)
+    else:
+        abort(400)
+    start = end - step * (periods - 1)
+
+    with replica_reads(db.session):
+        counts = dict(db.session.query(key, model.signups).filter(key >= start, key <= end).all())
+    # Fill in buckets with no signups so the series has one point per period
+    series = [{'period': (start + step * i).isoformat(), 'signups': counts.get(start + step * i, 0)}
+              for i in range(periods)]
+    return jsonify({
+        'granularity': granularity,
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'total': sum(point['signups'] for point in series),
+        'series': series,
+    })
+
+@app.route('/admin/export/users')
+@admin_required
+def export_users():
+    # Streamed batch by batch, so the response never holds more than one page of users
+    file_format = request.args.get('format', 'csv')
+    if file_format not in ('csv', 'jsonl'):
+        abort(400)
+    batch_size = min(max(request.args.get('batch_size', 1000, type=int), 1), 10000)
+    exported_by = current_user.username
+
+    def progress(count):
+        app.logger.debug('User export by %s: %d rows', exported_by, count)
+
+    lines = export_lines(db.session, User.__table__, file_format, batch_size, progress=progress)
+    response = app.response_class(
+        stream_with_context(lines),
+        mimetype='text/csv' if file_format == 'csv' else 'application/x-ndjson',
+    )
+    response.headers['Content-Disposition'] = f'attachment; filename=users-{datetime.utcnow():%Y%m%d}.{file_format}'
+    return response
+
+@app.errorhandler(HashingBusy)
+def hashing_busy(error):
+    # Reject quickly instead of queueing more work behind a saturated hashing pool
+    response = app.response_class('The service is busy. Please try again shortly.', status=503, mimetype='text/plain')
+    response.headers['Retry-After'] = '1'
+    return response
+
 # Configure static file caching
 @app.after_request
 def add_cache_headers(response):
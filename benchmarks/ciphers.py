@@ -0,0 +1,38 @@
+"""
+Micro-benchmark of the cipher backends for email-sized payloads.
+
+Run from the repository root:
+    python -m benchmarks.ciphers [--iterations N] [--size BYTES]
+"""
+import argparse
+import time
+from cryptography.fernet import Fernet
+from crypto_utils import CIPHER_BACKENDS
+
+def time_per_op(func, values):
+    """Return the mean nanoseconds per call of func over values"""
+    start = time.perf_counter_ns()
+    for value in values:
+        func(value)
+    return (time.perf_counter_ns() - start) / len(values)
+
+def bench_backend(backend, iterations, size):
+    """Return (encrypt ns/op, decrypt ns/op, stored bytes) for one backend"""
+    plaintexts = [(f"user{i}@example.com".ljust(size, 'x')[:size]).encode('utf-8') for i in range(iterations)]
+    payloads = [backend.encrypt(value) for value in plaintexts]
+    encrypt_ns = time_per_op(backend.encrypt, plaintexts)
+    decrypt_ns = time_per_op(backend.decrypt, payloads)
+    return encrypt_ns, decrypt_ns, len(payloads[0]) + 1
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare cipher backend speed for small fields")
+    parser.add_argument('--iterations', type=int, default=20000)
+    parser.add_argument('--size', type=int, default=24, help="plaintext size in bytes")
+    args = parser.parse_args()
+
+    # Use a throwaway key so the benchmark never touches real key material
+    keys = [Fernet.generate_key()]
+    print(f"{'backend':<10} {'encrypt ns/op':>14} {'decrypt ns/op':>14} {'stored bytes':>13}")
+    for name, backend_class in CIPHER_BACKENDS.items():
+        encrypt_ns, decrypt_ns, stored = bench_backend(backend_class(keys), args.iterations, args.size)
+        print(f"{name:<10} {encrypt_ns:>14.0f} {decrypt_ns:>14.0f} {stored:>13}")
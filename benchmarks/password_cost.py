@@ -0,0 +1,113 @@
+"""
+Password-hash cost calibration and auth capacity planner.
+
+Measures hash verification time for several PBKDF2 iteration counts and
+scrypt parameters on this host, on one core and with N worker processes,
+and recommends the most expensive method whose p99 verification latency
+under full load stays within a target.
+
+Run from the repository root:
+    python -m benchmarks.password_cost [--target-p99-ms 250] [--workers 1,2,4]
+"""
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from password_policy import generate_hash, check_hash, normalize_method
+
+DEFAULT_METHODS = [
+    'pbkdf2:sha256:100000',
+    'pbkdf2:sha256:260000',
+    'pbkdf2:sha256:600000',
+    'pbkdf2:sha256:1000000',
+    'scrypt:16384:8:1',
+    'scrypt:32768:8:1',
+    'scrypt:65536:8:1',
+]
+PASSWORD = 'calibration-password'
+
+def timed_check(pwhash):
+    """Verify a hash and return how long it took in seconds"""
+    start = time.perf_counter()
+    check_hash(pwhash, PASSWORD)
+    return time.perf_counter() - start
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+def measure_method(method, workers_list, samples):
+    """Return single-core and per-worker-count measurements for one method"""
+    start = time.perf_counter()
+    pwhash = generate_hash(PASSWORD, method=method)
+    generate_seconds = time.perf_counter() - start
+
+    single = [timed_check(pwhash) for _ in range(samples)]
+    result = {
+        'method': normalize_method(method),
+        'generate_ms': generate_seconds * 1000,
+        'check_p50_ms': percentile(single, 0.50) * 1000,
+        'check_p99_ms': percentile(single, 0.99) * 1000,
+        'hashes_per_sec_per_core': len(single) / sum(single),
+        'workers': [],
+    }
+
+    for workers in workers_list:
+        # Keep every worker busy for `samples` hashes so contention shows up in the latency
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(timed_check, [pwhash] * workers))  # warm up the processes
+            start = time.perf_counter()
+            durations = list(executor.map(timed_check, [pwhash] * (samples * workers)))
+            elapsed = time.perf_counter() - start
+        result['workers'].append({
+            'workers': workers,
+            'logins_per_sec': len(durations) / elapsed,
+            'check_p99_ms': percentile(durations, 0.99) * 1000,
+        })
+    return result
+
+def recommend(results, target_p99_ms):
+    """Pick the most expensive method whose p99 under the heaviest load fits the target"""
+    fitting = [r for r in results if r['workers'][-1]['check_p99_ms'] <= target_p99_ms]
+    if not fitting:
+        return None
+    return max(fitting, key=lambda r: r['check_p50_ms'])
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Calibrate password hash cost for this host")
+    parser.add_argument('--methods', default=','.join(DEFAULT_METHODS), help="comma-separated hash methods")
+    parser.add_argument('--workers', default=None, help="comma-separated worker counts (default: 1 and all cores)")
+    parser.add_argument('--samples', type=int, default=10, help="hashes per worker per measurement")
+    parser.add_argument('--target-p99-ms', type=float, default=250.0, help="target p99 verification latency")
+    parser.add_argument('--output', default=None, help="optional path for JSON results")
+    args = parser.parse_args()
+
+    cores = os.cpu_count() or 1
+    workers_list = sorted({int(w) for w in args.workers.split(',')}) if args.workers else sorted({1, cores})
+    methods = [method.strip() for method in args.methods.split(',') if method.strip()]
+
+    results = []
+    print(f"Host has {cores} core(s); measuring with worker counts {workers_list}")
+    print(f"{'method':<24} {'p50 ms':>8} {'p99 ms':>8} {'hash/s/core':>12}  logins/s (p99 ms) per worker count")
+    for method in methods:
+        result = measure_method(method, workers_list, args.samples)
+        results.append(result)
+        per_workers = '  '.join(f"{w['workers']}w: {w['logins_per_sec']:.1f} ({w['check_p99_ms']:.0f})" for w in result['workers'])
+        print(f"{result['method']:<24} {result['check_p50_ms']:>8.1f} {result['check_p99_ms']:>8.1f} "
+              f"{result['hashes_per_sec_per_core']:>12.1f}  {per_workers}")
+
+    best = recommend(results, args.target_p99_ms)
+    if best:
+        print(f"\nRecommended for p99 <= {args.target_p99_ms:.0f} ms at {workers_list[-1]} worker(s):")
+        print(f"  PASSWORD_HASH_METHOD={best['method']}")
+        print(f"  HASHING_WORKERS={workers_list[-1]} (about {best['workers'][-1]['logins_per_sec']:.0f} logins/sec)")
+    else:
+        print(f"\nNo method meets p99 <= {args.target_p99_ms:.0f} ms; try cheaper parameters or fewer workers per host")
+
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump({'cores': cores, 'target_p99_ms': args.target_p99_ms, 'results': results,
+                       'recommended': best['method'] if best else None}, output_file, indent=2)
+        print(f"Wrote results to {args.output}")
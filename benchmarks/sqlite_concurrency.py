@@ -0,0 +1,101 @@
+"""
+Concurrency benchmark for the SQLite production engine profile.
+
+Runs several worker processes doing a mix of username lookups and user
+inserts against a scratch database, once with the default SQLite settings
+and once with sqlite_profile.SQLITE_PRODUCTION_PRAGMAS, and reports read
+and write throughput plus how many operations failed with
+"database is locked".
+
+Run from the repository root:
+    python -m benchmarks.sqlite_concurrency [--workers 4] [--duration 5]
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+from datetime import datetime
+
+from sqlalchemy import create_engine, select
+from sqlalchemy.exc import OperationalError
+
+# Import the app against a scratch database so the real one is never touched
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(prefix='auth-bench-'), 'unused.db')
+from app import User, db
+from sqlite_profile import apply_sqlite_profile
+
+SEED_USERS = 10000
+
+def make_engine(path, profile):
+    # timeout=0 so failures show the raw locking behaviour; the profile sets its own busy_timeout
+    engine = create_engine(f'sqlite:///{path}', connect_args={'timeout': 0})
+    if profile:
+        apply_sqlite_profile(engine)
+    return engine
+
+def seed(path, profile):
+    engine = make_engine(path, profile)
+    db.metadata.create_all(engine, tables=[User.__table__])
+    now = datetime.utcnow()
+    with engine.begin() as connection:
+        connection.execute(User.__table__.insert(), [{
+            'username': f'seed{i}', 'email': f'seed{i}'.encode(), 'email_index': f'seed{i}',
+            'password': 'x', 'registered_on': now,
+        } for i in range(SEED_USERS)])
+    engine.dispose()
+
+def worker(path, profile, duration, write_ratio, worker_id, results):
+    engine = make_engine(path, profile)
+    user_table = User.__table__
+    reads = writes = locked = 0
+    deadline = time.monotonic() + duration
+    counter = 0
+    while time.monotonic() < deadline:
+        try:
+            if random.random() < write_ratio:
+                counter += 1
+                name = f'w{worker_id}-{counter}'
+                with engine.begin() as connection:
+                    connection.execute(user_table.insert().values(
+                        username=name, email=name.encode(), email_index=name,
+                        password='x', registered_on=datetime.utcnow()))
+                writes += 1
+            else:
+                with engine.connect() as connection:
+                    connection.execute(select(user_table.c.id).where(
+                        user_table.c.username == f'seed{random.randrange(SEED_USERS)}')).first()
+                reads += 1
+        except OperationalError as e:
+            if 'locked' not in str(e):
+                raise
+            locked += 1
+    engine.dispose()
+    results.put((reads, writes, locked))
+
+def run(profile, workers, duration, write_ratio):
+    path = os.path.join(tempfile.mkdtemp(prefix='auth-bench-'), 'bench.db')
+    seed(path, profile)
+    results = multiprocessing.Queue()
+    processes = [multiprocessing.Process(target=worker, args=(path, profile, duration, write_ratio, i, results))
+                 for i in range(workers)]
+    for process in processes:
+        process.start()
+    totals = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    reads, writes, locked = (sum(values) for values in zip(*totals))
+    return {'reads_per_sec': reads / duration, 'writes_per_sec': writes / duration, 'locked_errors': locked}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare SQLite throughput with and without the production profile")
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--duration', type=float, default=5.0, help="seconds per run")
+    parser.add_argument('--write-ratio', type=float, default=0.2, help="fraction of operations that are inserts")
+    args = parser.parse_args()
+
+    print(f"{'profile':<10} {'reads/sec':>10} {'writes/sec':>11} {'locked errors':>14}")
+    for label, profile in (('default', False), ('production', True)):
+        result = run(profile, args.workers, args.duration, args.write_ratio)
+        print(f"{label:<10} {result['reads_per_sec']:>10.0f} {result['writes_per_sec']:>11.0f} {result['locked_errors']:>14}")
@@ -0,0 +1,154 @@
+"""
+Benchmark suite for encryption and user lookups as the user table grows.
+
+Seeds a scratch SQLite database in steps (10k, 100k, 1M users by default)
+and measures per-operation latency and throughput at each size for:
+encrypt, decrypt, the User.email property, find_by_email, username lookup
+and an end-to-end POST /login. Results are written as JSON so runs can be
+compared over time.
+
+Run from the repository root:
+    python -m benchmarks.suite [--sizes 10000,100000] [--output results.json]
+"""
+import argparse
+import base64
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from cryptography.fernet import Fernet
+
+# Point the app at a scratch database and throwaway key before it is imported
+_SCRATCH_DIR = tempfile.mkdtemp(prefix='auth-bench-')
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(_SCRATCH_DIR, 'bench.db')
+os.environ['USER_DATA_ENCRYPTION_KEY'] = base64.urlsafe_b64encode(Fernet.generate_key()).decode()
+os.environ.pop('USER_DATA_INDEX_KEY', None)
+
+from werkzeug.security import generate_password_hash
+from app import app, db, User
+from crypto_utils import encrypt_data, decrypt_data, encrypt_many, email_blind_index, get_backend
+
+PASSWORD = 'benchmark-password'
+SEED_CHUNK = 10000
+
+def bench_email(i):
+    return f"bench{i}@example.com"
+
+def bench_username(i):
+    return f"bench{i}"
+
+def seed_users(start, stop, password_hash):
+    """Insert users [start, stop) with chunked executemany inserts"""
+    user_table = User.__table__
+    now = datetime.utcnow()
+    for chunk_start in range(start, stop, SEED_CHUNK):
+        indexes = range(chunk_start, min(chunk_start + SEED_CHUNK, stop))
+        emails = [bench_email(i) for i in indexes]
+        ciphertexts = encrypt_many(emails, compact=True)
+        rows = [{
+            'username': bench_username(i),
+            'email': ciphertext,
+            'email_index': email_blind_index(email),
+            'password': password_hash,
+            'registered_on': now,
+        } for i, email, ciphertext in zip(indexes, emails, ciphertexts)]
+        db.session.execute(user_table.insert(), rows)
+        db.session.commit()
+
+def measure(name, func, args):
+    """Call func once per argument and summarize the latencies"""
+    timings = []
+    for arg in args:
+        start = time.perf_counter_ns()
+        func(arg)
+        timings.append(time.perf_counter_ns() - start)
+    timings.sort()
+    total_seconds = sum(timings) / 1e9
+
+    def percentile(fraction):
+        return timings[min(len(timings) - 1, int(len(timings) * fraction))] / 1000
+
+    return {
+        'operation': name,
+        'samples': len(timings),
+        'mean_us': statistics.fmean(timings) / 1000,
+        'p50_us': percentile(0.50),
+        'p95_us': percentile(0.95),
+        'p99_us': percentile(0.99),
+        'ops_per_sec': len(timings) / total_seconds if total_seconds else None,
+    }
+
+def run_size(size, samples, login_samples):
+    """Run every benchmark against a table of `size` users"""
+    picks = [random.randrange(size) for _ in range(samples)]
+    emails = [bench_email(i) for i in picks]
+    ciphertexts = [encrypt_data(email, compact=True) for email in emails]
+
+    def email_property(user_id):
+        # Fresh session each time so the memoized plaintext doesn't hide the decrypt
+        db.session.expunge_all()
+        return db.session.get(User, user_id).email
+
+    def login(i):
+        # New app context so flask.g (and the logged-in user) doesn't leak between samples
+        with app.app_context(), app.test_client() as client:
+            response = client.post('/login', data={'username_or_email': bench_username(i), 'password': PASSWORD})
+            assert response.status_code == 302, f"login failed with {response.status_code}"
+
+    results = [
+        measure('encrypt', lambda email: encrypt_data(email, compact=True), emails),
+        measure('decrypt', decrypt_data, ciphertexts),
+        measure('email_property', email_property, [i + 1 for i in picks]),
+        measure('find_by_email', User.find_by_email, emails),
+        measure('username_lookup', lambda i: User.query.filter_by(username=bench_username(i)).first(), picks),
+        measure('login', login, picks[:login_samples]),
+    ]
+    for result in results:
+        result['users'] = size
+    return results
+
+def print_results(results):
+    print(f"{'users':>9} {'operation':<16} {'samples':>7} {'mean us':>10} {'p50 us':>10} {'p99 us':>10} {'ops/sec':>10}")
+    for r in results:
+        print(f"{r['users']:>9} {r['operation']:<16} {r['samples']:>7} {r['mean_us']:>10.1f} "
+              f"{r['p50_us']:>10.1f} {r['p99_us']:>10.1f} {r['ops_per_sec']:>10.0f}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark encryption and user lookups")
+    parser.add_argument('--sizes', default='10000,100000,1000000', help="comma-separated user counts")
+    parser.add_argument('--samples', type=int, default=2000, help="samples per operation")
+    parser.add_argument('--login-samples', type=int, default=20, help="samples for the end-to-end login")
+    parser.add_argument('--output', default='bench_output.json', help="path of the JSON results file")
+    args = parser.parse_args()
+
+    sizes = sorted(int(size) for size in args.sizes.split(','))
+    password_hash = generate_password_hash(PASSWORD, method='pbkdf2:sha256')
+    results = []
+
+    with app.app_context():
+        db.create_all()
+        seeded = 0
+        for size in sizes:
+            # Grow the same database step by step instead of reseeding from scratch
+            print(f"Seeding users {seeded}..{size} into {_SCRATCH_DIR}")
+            seed_users(seeded, size, password_hash)
+            seeded = size
+            results.extend(run_size(size, args.samples, args.login_samples))
+
+    print_results(results)
+    report = {
+        'timestamp': datetime.utcnow().isoformat() + 'Z',
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'cipher': get_backend().name,
+        'results': results,
+    }
+    with open(args.output, 'w') as output_file:
+        json.dump(report, output_file, indent=2)
+    print(f"Wrote results to {args.output}")
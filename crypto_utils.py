@@ -1,17 +1,41 @@
-from cryptography.fernet import Fernet
-from cryptography.hazmat.primitives import hashes
-from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+from cryptography.fernet import Fernet, MultiFernet, InvalidToken
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM, ChaCha20Poly1305
 import base64
+import contextlib
 import os
 import functools
+import hmac
+import hashlib
+import itertools
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 
 # This file path should be added to .gitignore to ensure it's not committed to version control
 KEY_FILE = 'encryption_key.key'
+# The blind-index key has its own file so rotating and retiring encryption keys never changes it
+INDEX_KEY_FILE = 'index_key.key'
 ENV_KEY_NAME = 'USER_DATA_ENCRYPTION_KEY'
+INDEX_ENV_KEY_NAME = 'USER_DATA_INDEX_KEY'
+CIPHER_ENV_NAME = 'USER_DATA_CIPHER'
+# Seconds between checks of the key file for changes made by rotate_keys.py
+KEY_RELOAD_INTERVAL_ENV_NAME = 'USER_DATA_KEY_RELOAD_INTERVAL'
+DEFAULT_KEY_RELOAD_INTERVAL = 5.0
+DEFAULT_CIPHER = 'aesgcm'
 
-# Cache for key and Fernet instance
-_KEY_CACHE = None
+# Version byte prefixed to compact binary ciphertexts, one per cipher backend
+STORAGE_VERSION_FERNET = b'\x01'
+STORAGE_VERSION_AESGCM = b'\x02'
+STORAGE_VERSION_CHACHA20 = b'\x03'
+
+# Cache for key ring and Fernet instances
+_KEYS_CACHE = None
 _FERNET_INSTANCE = None
+_INDEX_KEY_CACHE = None
+_BACKEND_CACHE = {}
+_KEY_FILE_MTIME = None
+_KEY_FILE_CHECKED_AT = 0.0
 
 def generate_key():
     """Generate a new encryption key and save it to a file"""
@@ -26,21 +50,95 @@ def generate_key():
         print(f"Generated new encryption key and stored in {KEY_FILE}")
         print(f"For production use, set this key as an environment variable named {ENV_KEY_NAME}")
 
-def get_key():
-    """Retrieve the encryption key from environment variable or file with caching"""
-    global _KEY_CACHE
+def _write_key_file(keys):
+    """Replace the key file atomically so other processes never read a partial ring"""
+    temp_path = KEY_FILE + '.tmp'
+    with open(temp_path, 'wb') as key_file:
+        key_file.write(b'\n'.join(keys))
+    os.replace(temp_path, KEY_FILE)
+    reset_key_cache()
+
+def stage_key():
+    """
+    Generate a new key and add it to the file-based key ring as a decrypt-only secondary key.
+    Running processes pick it up on their next key file check; promote it
+    with promote_key() only after every process has it.
+    """
+    if os.environ.get(ENV_KEY_NAME):
+        raise RuntimeError(f"Keys are configured through {ENV_KEY_NAME}; add the new key there instead")
+
+    keys = get_keys()
+    # Pin the blind-index key before the ring changes so it can never be derived from a different key
+    get_index_key()
+    new_key = Fernet.generate_key()
+    _write_key_file(keys[:1] + [new_key] + keys[1:])
+    print(f"Staged new decrypt-only key in {KEY_FILE} ({len(keys) + 1} keys in ring)")
+    return new_key
+
+def promote_key():
+    """Make the most recently staged key (second in the ring) the primary key used for encryption"""
+    if os.environ.get(ENV_KEY_NAME):
+        raise RuntimeError(f"Keys are configured through {ENV_KEY_NAME}; reorder the keys there instead")
+
+    keys = get_keys()
+    if len(keys) < 2:
+        raise RuntimeError("No staged key to promote; run with --stage-key first")
+    _write_key_file([keys[1], keys[0]] + keys[2:])
+    print(f"Promoted staged key to primary in {KEY_FILE}")
+    return keys[1]
+
+def key_reload_interval():
+    return float(os.environ.get(KEY_RELOAD_INTERVAL_ENV_NAME, DEFAULT_KEY_RELOAD_INTERVAL))
+
+def _check_key_file():
+    """Drop cached keys if the key file changed on disk; stats the file at most once per reload interval"""
+    global _KEY_FILE_CHECKED_AT
+    if _KEY_FILE_MTIME is None:
+        return
+    now = time.monotonic()
+    if now - _KEY_FILE_CHECKED_AT < key_reload_interval():
+        return
+    _KEY_FILE_CHECKED_AT = now
+    try:
+        mtime = os.stat(KEY_FILE).st_mtime_ns
+    except OSError:
+        return
+    if mtime != _KEY_FILE_MTIME:
+        reset_key_cache()
+
+def reset_key_cache():
+    """Drop cached keys and cipher instances so they are reloaded on next use"""
+    global _KEYS_CACHE, _FERNET_INSTANCE, _INDEX_KEY_CACHE, _KEY_FILE_MTIME
+    _KEYS_CACHE = None
+    _KEY_FILE_MTIME = None
+    _FERNET_INSTANCE = None
+    _INDEX_KEY_CACHE = None
+    _BACKEND_CACHE.clear()
+
+def get_keys():
+    """
+    Retrieve the key ring from environment variable or file with caching.
+
+    The environment variable holds comma-separated base64-encoded keys and
+    the key file holds one key per line. The first key is the primary key
+    used for encryption; the others are only used to decrypt older data.
+    A file-based ring is reloaded when the file changes.
+    """
+    global _KEYS_CACHE, _KEY_FILE_MTIME, _KEY_FILE_CHECKED_AT
     
-    # Return cached key if available
-    if _KEY_CACHE is not None:
-        return _KEY_CACHE
+    _check_key_file()
+    # Return cached keys if available
+    if _KEYS_CACHE is not None:
+        return _KEYS_CACHE
     
     # First check environment variable (safer for production)
     env_key = os.environ.get(ENV_KEY_NAME)
     if env_key:
         try:
-            # Environment key should be base64 encoded
-            _KEY_CACHE = base64.urlsafe_b64decode(env_key.encode())
-            return _KEY_CACHE
+            # Environment keys should be base64 encoded
+            _KEYS_CACHE = [base64.urlsafe_b64decode(key.strip().encode())
+                           for key in env_key.split(',') if key.strip()]
+            return _KEYS_CACHE
         except Exception as e:
             print(f"WARNING: Invalid encryption key in environment variable: {e}")
     
@@ -48,53 +146,400 @@ def get_key():
     if not os.path.exists(KEY_FILE):
         generate_key()
     
+    mtime = os.stat(KEY_FILE).st_mtime_ns
     with open(KEY_FILE, 'rb') as key_file:
-        _KEY_CACHE = key_file.read()
+        _KEYS_CACHE = [line.strip() for line in key_file.read().splitlines() if line.strip()]
+    _KEY_FILE_MTIME = mtime
+    _KEY_FILE_CHECKED_AT = time.monotonic()
         
-    return _KEY_CACHE
+    return _KEYS_CACHE
+
+def get_key():
+    """Retrieve the primary encryption key"""
+    return get_keys()[0]
 
 def get_fernet():
-    """Get or create a cached Fernet instance"""
+    """Get or create a cached MultiFernet over the whole key ring"""
     global _FERNET_INSTANCE
     
+    _check_key_file()
     if _FERNET_INSTANCE is None:
-        key = get_key()
-        _FERNET_INSTANCE = Fernet(key)
+        _FERNET_INSTANCE = MultiFernet([Fernet(key) for key in get_keys()])
         
     return _FERNET_INSTANCE
 
-def encrypt_data(data):
-    """Encrypt string data using Fernet symmetric encryption"""
+class CipherBackend:
+    """
+    Base class for cipher backends used by the compact storage format.
+
+    A backend encrypts with the primary key of the ring and decrypts with
+    any key in it. Payloads exclude the storage version byte.
+    """
+    name = None
+    version = None
+
+    def __init__(self, keys):
+        self.keys = keys
+
+    def encrypt(self, data):
+        """Encrypt bytes with the primary key and return the payload"""
+        raise NotImplementedError
+
+    def decrypt(self, payload):
+        """Decrypt a payload, returning (plaintext bytes, index of the key that worked)"""
+        raise NotImplementedError
+
+class FernetBackend(CipherBackend):
+    """AES-128-CBC with HMAC-SHA256; payload is the binary Fernet token"""
+    name = 'fernet'
+    version = STORAGE_VERSION_FERNET
+
+    def __init__(self, keys):
+        super().__init__(keys)
+        self.fernets = [Fernet(key) for key in keys]
+
+    def encrypt(self, data):
+        return base64.urlsafe_b64decode(self.fernets[0].encrypt(data))
+
+    def decrypt(self, payload):
+        token = base64.urlsafe_b64encode(payload)
+        for index, f in enumerate(self.fernets):
+            try:
+                return f.decrypt(token), index
+            except InvalidToken:
+                continue
+        raise InvalidToken
+
+class AEADBackend(CipherBackend):
+    """AEAD cipher with a random 96-bit nonce; payload is nonce followed by ciphertext and tag"""
+    aead_class = None
+    nonce_size = 12
+
+    def __init__(self, keys):
+        super().__init__(keys)
+        # Derive a per-backend 256-bit key from each Fernet key in the ring
+        self.ciphers = [
+            self.aead_class(hmac.new(base64.urlsafe_b64decode(key), self.name.encode(), hashlib.sha256).digest())
+            for key in keys
+        ]
+
+    def encrypt(self, data):
+        nonce = os.urandom(self.nonce_size)
+        return nonce + self.ciphers[0].encrypt(nonce, data, None)
+
+    def decrypt(self, payload):
+        nonce, ciphertext = payload[:self.nonce_size], payload[self.nonce_size:]
+        for index, cipher in enumerate(self.ciphers):
+            try:
+                return cipher.decrypt(nonce, ciphertext, None), index
+            except InvalidTag:
+                continue
+        raise InvalidToken
+
+class AESGCMBackend(AEADBackend):
+    """AES-256-GCM"""
+    name = 'aesgcm'
+    version = STORAGE_VERSION_AESGCM
+    aead_class = AESGCM
+
+class ChaCha20Backend(AEADBackend):
+    """ChaCha20-Poly1305"""
+    name = 'chacha20'
+    version = STORAGE_VERSION_CHACHA20
+    aead_class = ChaCha20Poly1305
+
+CIPHER_BACKENDS = {backend.name: backend for backend in (FernetBackend, AESGCMBackend, ChaCha20Backend)}
+_BACKENDS_BY_VERSION = {backend.version: backend for backend in CIPHER_BACKENDS.values()}
+
+def get_backend(name=None):
+    """Get or create a cached cipher backend; defaults to the one configured for new writes"""
+    if name is None:
+        name = os.environ.get(CIPHER_ENV_NAME, DEFAULT_CIPHER)
+    _check_key_file()
+    backend = _BACKEND_CACHE.get(name)
+    if backend is None:
+        if name not in CIPHER_BACKENDS:
+            raise ValueError(f"Unknown cipher backend: {name}")
+        backend = _BACKEND_CACHE[name] = CIPHER_BACKENDS[name](get_keys())
+    return backend
+
+def _split_storage(encrypted_data):
+    """Return (backend, payload) for a stored value in either storage format"""
+    if isinstance(encrypted_data, (bytes, memoryview)):
+        encrypted_data = bytes(encrypted_data)
+        backend_class = _BACKENDS_BY_VERSION.get(encrypted_data[:1])
+        if backend_class is None:
+            raise ValueError(f"Unknown ciphertext version: {encrypted_data[:1]!r}")
+        return get_backend(backend_class.name), encrypted_data[1:]
+    # Legacy format: base64 string wrapping the Fernet token
+    return get_backend('fernet'), base64.urlsafe_b64decode(base64.b64decode(encrypted_data.encode('utf-8')))
+
+def encrypt_data(data, compact=False):
+    """
+    Encrypt string data for storage.
+
+    By default returns the legacy base64 string of a Fernet token. With
+    compact=True returns raw bytes for a binary column: a version byte
+    identifying the cipher backend followed by its payload. New compact
+    writes use the backend named by USER_DATA_CIPHER (AES-GCM by default).
+    """
     if data is None:
         return None
         
-    # Use cached Fernet instance
-    f = get_fernet()
     # Convert string to bytes
     data_bytes = data.encode('utf-8')
-    # Encrypt the data
-    encrypted_data = f.encrypt(data_bytes)
-    # Return base64 encoded string for storage
-    return base64.b64encode(encrypted_data).decode('utf-8')
+    if compact:
+        backend = get_backend()
+        return backend.version + backend.encrypt(data_bytes)
+    # Use cached Fernet instance and return base64 encoded token for storage
+    return base64.b64encode(get_fernet().encrypt(data_bytes)).decode('utf-8')
+
+def is_compact(encrypted_data):
+    """Return True if a stored value is already in the compact binary format"""
+    return isinstance(encrypted_data, (bytes, memoryview)) and bytes(encrypted_data[:1]) in _BACKENDS_BY_VERSION
+
+def to_compact(encrypted_data):
+    """Convert a legacy base64 ciphertext to the compact binary format without decrypting"""
+    if encrypted_data is None or isinstance(encrypted_data, bytes):
+        return encrypted_data
+    backend, payload = _split_storage(encrypted_data)
+    return backend.version + payload
+
+def _decrypt_value(encrypted_data):
+    """Decrypt a single stored value in any storage format, raising on failure"""
+    backend, payload = _split_storage(encrypted_data)
+    return backend.decrypt(payload)[0].decode('utf-8')
 
 def decrypt_data(encrypted_data):
-    """Decrypt previously encrypted data"""
+    """Decrypt previously encrypted data stored in any format"""
     if encrypted_data is None:
         return None
         
-    # Use cached Fernet instance
-    f = get_fernet()
-    # Convert from base64 string to bytes
     try:
-        encrypted_bytes = base64.b64decode(encrypted_data.encode('utf-8'))
-        # Decrypt the data
-        decrypted_data = f.decrypt(encrypted_bytes)
-        # Return as string
-        return decrypted_data.decode('utf-8')
+        return _decrypt_value(encrypted_data)
     except Exception as e:
         print(f"Error decrypting data: {e}")
         # Return None instead of original data to prevent data exposure
         return None
 
-# Create a key when module is imported
-generate_key() 
\ No newline at end of file
+def _is_current(backend, key_index, compact):
+    """Return True if data decrypted this way is already in the preferred form"""
+    if key_index != 0:
+        return False
+    # Compact values should also be on the configured backend; legacy strings are always Fernet
+    return not compact or backend is get_backend()
+
+def decrypt_with_status(encrypted_data):
+    """
+    Decrypt data and report whether it needs re-encryption.
+    Returns (plaintext, stale) where stale is True when the value was
+    encrypted with an older key in the ring or, for compact values, with a
+    cipher backend other than the one configured for new writes.
+    """
+    if encrypted_data is None:
+        return None, False
+
+    try:
+        backend, payload = _split_storage(encrypted_data)
+        plaintext, key_index = backend.decrypt(payload)
+        compact = isinstance(encrypted_data, (bytes, memoryview))
+        return plaintext.decode('utf-8'), not _is_current(backend, key_index, compact)
+    except Exception as e:
+        print(f"Error decrypting data: {e}")
+        return None, False
+
+def needs_rotation(encrypted_data):
+    """Return True if a stored value should be re-encrypted with the primary key and backend"""
+    if encrypted_data is None:
+        return False
+    backend, payload = _split_storage(encrypted_data)
+    key_index = backend.decrypt(payload)[1]
+    return not _is_current(backend, key_index, isinstance(encrypted_data, (bytes, memoryview)))
+
+def rotate_data(encrypted_data):
+    """Re-encrypt a stored value under the primary key, keeping its storage format"""
+    if encrypted_data is None:
+        return None
+    compact = isinstance(encrypted_data, (bytes, memoryview))
+    return encrypt_data(_decrypt_value(encrypted_data), compact=compact)
+
+def _encrypt_chunk(chunk, compact=False):
+    """Encrypt a list of values, returning (results, errors) for the chunk"""
+    results = []
+    errors = []
+    for position, value in enumerate(chunk):
+        try:
+            results.append(encrypt_data(value, compact=compact))
+        except Exception as e:
+            results.append(None)
+            errors.append((position, f"{type(e).__name__}: {e}"))
+    return results, errors
+
+def _decrypt_chunk(chunk):
+    """Decrypt a list of values, returning (results, errors) for the chunk"""
+    results = []
+    errors = []
+    for position, value in enumerate(chunk):
+        if value is None:
+            results.append(None)
+            continue
+        try:
+            results.append(_decrypt_value(value))
+        except Exception as e:
+            # Return None instead of original data to prevent data exposure
+            results.append(None)
+            errors.append((position, f"{type(e).__name__}: {e}"))
+    return results, errors
+
+def worker_pool(workers, use_processes=True):
+    """
+    Create an executor for ordered_results. Key material is loaded first,
+    so forked process workers inherit it instead of each loading it.
+    """
+    if use_processes:
+        preload()
+        return ProcessPoolExecutor(max_workers=workers)
+    return ThreadPoolExecutor(max_workers=workers)
+
+def ordered_results(func, items, executor, max_pending):
+    """
+    Run func over items on executor, yielding (item, result) pairs in input order.
+    At most max_pending items are in flight, so memory stays flat on huge inputs.
+    """
+    pending = deque()
+    for item in items:
+        pending.append((item, executor.submit(func, item)))
+        if len(pending) >= max_pending:
+            item, future = pending.popleft()
+            yield item, future.result()
+    while pending:
+        item, future = pending.popleft()
+        yield item, future.result()
+
+def _chunk_values(chunk_results, errors):
+    """Flatten (chunk, (results, errors)) pairs into results, offsetting error positions into the whole input"""
+    offset = 0
+    for chunk, (results, chunk_errors) in chunk_results:
+        if errors is not None:
+            errors.extend((offset + position, message) for position, message in chunk_errors)
+        offset += len(chunk)
+        yield from results
+
+def _process_many(chunk_func, values, errors, workers, chunk_size, use_processes, executor=None):
+    """Run chunk_func over values in a worker pool, yielding results in input order"""
+    iterator = iter(values)
+    chunks = iter(lambda: list(itertools.islice(iterator, chunk_size)), [])
+
+    if workers == 0 and executor is None:
+        # Run inline, useful for small jobs and debugging
+        yield from _chunk_values(((chunk, chunk_func(chunk)) for chunk in chunks), errors)
+        return
+
+    workers = workers or os.cpu_count() or 1
+    # A caller-supplied executor is reused across calls and left running
+    pool = worker_pool(workers, use_processes) if executor is None else contextlib.nullcontext(executor)
+    with pool as executor:
+        yield from _chunk_values(ordered_results(chunk_func, chunks, executor, workers * 2), errors)
+
+def encrypt_many(values, errors=None, workers=None, chunk_size=1000, use_processes=False, compact=False,
+                 executor=None):
+    """
+    Encrypt an iterable of strings, yielding encrypted values in input order.
+
+    Work is split into chunks of chunk_size and spread over a thread pool
+    (or a process pool when use_processes is True) with `workers` workers;
+    workers=0 runs inline. Callers processing many batches can pass an
+    executor from worker_pool to reuse it. Failures yield None and, if an
+    errors list is given, append (index, message) to it instead of printing
+    per value. compact selects the storage format as in encrypt_data.
+    """
+    chunk_func = functools.partial(_encrypt_chunk, compact=compact)
+    return _process_many(chunk_func, values, errors, workers, chunk_size, use_processes, executor)
+
+def decrypt_many(values, errors=None, workers=None, chunk_size=1000, use_processes=False, executor=None):
+    """
+    Decrypt an iterable of stored values, yielding plaintexts in input order.
+
+    Takes the same pool options as encrypt_many. Values that fail to
+    decrypt yield None and are reported through the optional errors list
+    as (index, message) tuples.
+    """
+    return _process_many(_decrypt_chunk, values, errors, workers, chunk_size, use_processes, executor)
+
+def get_index_key():
+    """
+    Retrieve the HMAC key used for blind indexes with caching.
+
+    The key is independent of the encryption key ring: it comes from
+    USER_DATA_INDEX_KEY (base64) or INDEX_KEY_FILE. Deployments that predate
+    the index key file derive it once from the oldest encryption key, as
+    before, and a file-based setup then persists it so retiring that key
+    later leaves every index valid.
+    """
+    global _INDEX_KEY_CACHE
+
+    if _INDEX_KEY_CACHE is not None:
+        return _INDEX_KEY_CACHE
+
+    env_key = os.environ.get(INDEX_ENV_KEY_NAME)
+    if env_key:
+        try:
+            key = base64.urlsafe_b64decode(env_key.strip().encode('utf-8'))
+        except Exception as e:
+            raise ValueError(f"{INDEX_ENV_KEY_NAME} must be base64-encoded: {e}")
+        if len(key) < 16:
+            raise ValueError(f"{INDEX_ENV_KEY_NAME} must decode to at least 16 bytes")
+        _INDEX_KEY_CACHE = key
+    elif os.path.exists(INDEX_KEY_FILE):
+        with open(INDEX_KEY_FILE, 'rb') as key_file:
+            _INDEX_KEY_CACHE = base64.urlsafe_b64decode(key_file.read().strip())
+    else:
+        # Derive a separate key so the index never reuses the encryption key directly
+        _INDEX_KEY_CACHE = hmac.new(get_keys()[-1], b'blind-index', hashlib.sha256).digest()
+        if not os.environ.get(ENV_KEY_NAME):
+            persist_index_key(_INDEX_KEY_CACHE)
+
+    return _INDEX_KEY_CACHE
+
+def persist_index_key(key):
+    """Write the blind-index key to INDEX_KEY_FILE unless one already exists"""
+    if os.path.exists(INDEX_KEY_FILE):
+        return
+    temp_path = f"{INDEX_KEY_FILE}.{os.getpid()}.tmp"
+    with open(temp_path, 'wb') as key_file:
+        key_file.write(base64.urlsafe_b64encode(key))
+    os.replace(temp_path, INDEX_KEY_FILE)
+
+def export_index_key():
+    """Return the current blind-index key base64-encoded, the format USER_DATA_INDEX_KEY expects"""
+    return base64.urlsafe_b64encode(get_index_key()).decode('utf-8')
+
+def normalize_email(email):
+    """Normalize an email address before indexing it"""
+    if email is None:
+        return None
+    return email.strip().lower()
+
+def blind_index(data):
+    """Compute a deterministic keyed HMAC of data for indexed equality lookups"""
+    if data is None:
+        return None
+    return hmac.new(get_index_key(), data.encode('utf-8'), hashlib.sha256).hexdigest()
+
+def email_blind_index(email):
+    """Compute the blind index for an email address"""
+    return blind_index(normalize_email(email))
+
+def preload():
+    """
+    Load key material and build every cipher instance up front.
+
+    Keys are otherwise loaded lazily on first use. Prefork servers should
+    call this once in the master process (e.g. from gunicorn's on_starting
+    hook with preload_app) so forked workers share the initialized state
+    copy-on-write instead of each loading it on their first request.
+    """
+    get_fernet()
+    for name in CIPHER_BACKENDS:
+        get_backend(name)
+    get_index_key() 
\ No newline at end of file
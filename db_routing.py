@@ -0,0 +1,37 @@
+import random
+from contextlib import contextmanager
+from flask_sqlalchemy.session import Session
+
+# Bind keys under which read replicas are registered in SQLALCHEMY_BINDS
+REPLICA_BIND_PREFIX = 'replica_'
+
+def replica_binds(urls):
+    """Build SQLALCHEMY_BINDS entries for a list of replica database URLs"""
+    return {f'{REPLICA_BIND_PREFIX}{index}': url for index, url in enumerate(urls)}
+
+class RoutingSession(Session):
+    """
+    Session that sends reads made inside replica_reads() to a read replica.
+
+    Everything else, including every flush, goes to the primary as usual.
+    Objects loaded from a replica are ordinary session members, so changes
+    made to them are written to the primary.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and self.info.get('replica_reads') and not self._flushing:
+            replicas = [engine for key, engine in self._db.engines.items()
+                        if isinstance(key, str) and key.startswith(REPLICA_BIND_PREFIX)]
+            if replicas:
+                return random.choice(replicas)
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+@contextmanager
+def replica_reads(session):
+    """Route queries made in this block to a read replica, if any are configured"""
+    previous = session.info.get('replica_reads', False)
+    session.info['replica_reads'] = True
+    try:
+        yield
+    finally:
+        session.info['replica_reads'] = previous
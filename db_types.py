@@ -0,0 +1,119 @@
+from sqlalchemy.types import TypeDecorator, LargeBinary
+from crypto_utils import encrypt_data, decrypt_data, decrypt_many
+
+class Ciphertext(TypeDecorator):
+    """
+    Binary column for compact ciphertexts produced by encrypt_data(..., compact=True).
+
+    Legacy base64 text values written before the compact format are passed
+    through unchanged in both directions, so a table can hold a mix of both
+    formats while it is being converted.
+    """
+    impl = LargeBinary
+    cache_ok = True
+
+    def bind_processor(self, dialect):
+        binary_processor = self.impl_instance.bind_processor(dialect)
+
+        def process(value):
+            if binary_processor is None or value is None or isinstance(value, str):
+                return value
+            return binary_processor(value)
+
+        return process
+
+    def result_processor(self, dialect, coltype):
+        binary_processor = self.impl_instance.result_processor(dialect, coltype)
+
+        def process(value):
+            if binary_processor is None or value is None or isinstance(value, str):
+                return value
+            return binary_processor(value)
+
+        return process
+
+class EncryptedValue:
+    """
+    Ciphertext loaded from an EncryptedString column, decrypted on first use.
+
+    Behaves like the plaintext string for str(), comparisons and string
+    methods, so templates and code can use it directly. Rows that are
+    loaded but never touched are never decrypted.
+    """
+    __slots__ = ('ciphertext', '_plaintext', '_decrypted')
+
+    def __init__(self, ciphertext):
+        self.ciphertext = ciphertext
+        self._plaintext = None
+        self._decrypted = False
+
+    @property
+    def value(self):
+        """The decrypted plaintext, memoized"""
+        if not self._decrypted:
+            self._plaintext = decrypt_data(self.ciphertext)
+            self._decrypted = True
+        return self._plaintext
+
+    @classmethod
+    def decrypt_all(cls, values, **pool_options):
+        """
+        Decrypt many EncryptedValues in one decrypt_many call, e.g. before an export.
+        Keyword arguments are passed to crypto_utils.decrypt_many.
+        """
+        pending = [value for value in values if isinstance(value, cls) and not value._decrypted]
+        for value, plaintext in zip(pending, decrypt_many([value.ciphertext for value in pending], **pool_options)):
+            value._plaintext = plaintext
+            value._decrypted = True
+
+    def __str__(self):
+        return self.value or ''
+
+    def __repr__(self):
+        # Never include the plaintext in reprs that may end up in logs
+        return f"<EncryptedValue decrypted={self._decrypted}>"
+
+    def __eq__(self, other):
+        if isinstance(other, EncryptedValue):
+            other = other.value
+        return self.value == other
+
+    def __hash__(self):
+        return hash(self.value)
+
+    def __bool__(self):
+        return bool(self.value)
+
+    def __len__(self):
+        return len(self.value or '')
+
+    def __getattr__(self, name):
+        # Delegate string methods such as lower() or split() to the plaintext
+        return getattr(self.value, name)
+
+class EncryptedString(TypeDecorator):
+    """
+    String column encrypted with crypto_utils in the compact storage format.
+
+    Plaintext strings are encrypted in bind processing. Result processing
+    only wraps the stored bytes in an EncryptedValue, so decryption happens
+    when the attribute is actually used. Values loaded from the database and
+    written back unchanged are stored as-is without re-encrypting.
+
+    Ciphertexts are randomized, so the column can't be used in equality
+    filters; add a blind index (see User.email_index) if lookups are needed.
+    """
+    impl = LargeBinary
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        if isinstance(value, EncryptedValue):
+            return value.ciphertext
+        return encrypt_data(value, compact=True)
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return EncryptedValue(value)
@@ -0,0 +1,121 @@
+import argparse
+import csv
+import io
+import json
+import math
+import os
+import sys
+import time
+from sqlalchemy import func, select
+from crypto_utils import decrypt_many, worker_pool
+from db_routing import replica_reads
+
+EXPORT_COLUMNS = ('id', 'username', 'email', 'registered_on')
+
+def iter_user_batches(session, user_table, batch_size=1000, workers=0, after_id=0):
+    """
+    Yield lists of user records with decrypted emails, paging by primary key.
+
+    Each batch is one `id > last_id ORDER BY id LIMIT batch_size` query on a
+    read replica if configured, and its emails are decrypted with
+    decrypt_many, split into one chunk per worker on a thread pool kept for
+    the whole export (workers=None uses all cores, 0 decrypts inline). The
+    read transaction is ended after every batch so a long export doesn't
+    pin a connection. Emails that can't be decrypted are exported as empty
+    values.
+    """
+    workers = (os.cpu_count() or 1) if workers is None else workers
+    chunk_size = math.ceil(batch_size / workers) if workers else batch_size
+    columns = select(user_table.c.id, user_table.c.username, user_table.c.email, user_table.c.registered_on)
+    last_id = after_id
+    executor = worker_pool(workers, use_processes=False) if workers else None
+    try:
+        while True:
+            with replica_reads(session):
+                rows = session.execute(
+                    columns.where(user_table.c.id > last_id).order_by(user_table.c.id).limit(batch_size)
+                ).all()
+            session.rollback()
+            if not rows:
+                return
+
+            emails = decrypt_many([row.email for row in rows], errors=[], workers=workers,
+                                  chunk_size=chunk_size, executor=executor)
+            yield [{
+                'id': row.id,
+                'username': row.username,
+                'email': email or '',
+                'registered_on': row.registered_on.isoformat() if row.registered_on else '',
+            } for row, email in zip(rows, emails)]
+            last_id = rows[-1].id
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+def format_csv(batches):
+    """Render batches as CSV, yielding one string for the header and one per batch"""
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_COLUMNS)
+    writer.writeheader()
+    for batch in batches:
+        writer.writerows(batch)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+def format_jsonl(batches):
+    """Render batches as JSON Lines, yielding one string per batch"""
+    for batch in batches:
+        yield ''.join(json.dumps(record) + '\n' for record in batch)
+
+FORMATTERS = {'csv': format_csv, 'jsonl': format_jsonl}
+
+def export_lines(session, user_table, file_format='csv', batch_size=1000, workers=0, progress=None):
+    """
+    Stream every user as CSV or JSONL text chunks in bounded memory.
+    progress, if given, is called with the running row count after each batch.
+    """
+    def counted(batches):
+        count = 0
+        for batch in batches:
+            count += len(batch)
+            yield batch
+            if progress:
+                progress(count)
+
+    return FORMATTERS[file_format](counted(iter_user_batches(session, user_table, batch_size, workers)))
+
+def count_users(session, user_table):
+    with replica_reads(session):
+        total = session.execute(select(func.count()).select_from(user_table)).scalar()
+    session.rollback()
+    return total
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export users with decrypted emails as CSV or JSONL")
+    parser.add_argument('output', help="output file, or - for stdout")
+    parser.add_argument('--format', choices=sorted(FORMATTERS), default=None, help="default: from the file extension")
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--workers', type=int, default=None, help="decryption threads, shared by all batches (default: all cores, 0 = inline)")
+    args = parser.parse_args()
+
+    from app import app, User, db
+
+    file_format = args.format or ('jsonl' if args.output.endswith(('.jsonl', '.ndjson')) else 'csv')
+    with app.app_context():
+        total = count_users(db.session, User.__table__)
+        start = time.perf_counter()
+
+        def report(count):
+            # Progress goes to stderr so exporting to stdout stays clean
+            elapsed = time.perf_counter() - start
+            print(f"Exported {count}/{total} user(s) ({count / elapsed:.0f}/sec)", file=sys.stderr)
+
+        output_file = sys.stdout if args.output == '-' else open(args.output, 'w', newline='', encoding='utf-8')
+        try:
+            for chunk in export_lines(db.session, User.__table__, file_format, args.batch_size, args.workers, report):
+                output_file.write(chunk)
+        finally:
+            if output_file is not sys.stdout:
+                output_file.close()
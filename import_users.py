@@ -0,0 +1,252 @@
+import argparse
+import csv
+import functools
+import hashlib
+import itertools
+import json
+import os
+import string
+import time
+from datetime import datetime
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+from app import app, User, db, password_policy, record_signups
+from crypto_utils import encrypt_data, email_blind_index, ordered_results, worker_pool
+from password_policy import generate_hash, normalize_method
+
+MAX_USERNAME_LENGTH = 80
+MAX_PASSWORD_HASH_LENGTH = 200
+# Weakest imported hashes accepted; anything cheaper is rejected rather than stored
+MIN_PBKDF2_ITERATIONS = 100000
+MIN_SCRYPT_N = 2 ** 14
+MIN_SCRYPT_R = 8
+
+def read_rows(path, file_format=None):
+    """
+    Stream (line_number, row dict) pairs from a CSV file with a header row or a JSONL file.
+    The format is taken from the file extension unless given.
+    """
+    file_format = file_format or ('jsonl' if path.endswith(('.jsonl', '.ndjson')) else 'csv')
+    with open(path, newline='', encoding='utf-8') as input_file:
+        if file_format == 'csv':
+            reader = csv.DictReader(input_file)
+            for row in reader:
+                yield reader.line_num, row
+        else:
+            for line_number, line in enumerate(input_file, 1):
+                if not line.strip():
+                    continue
+                try:
+                    row = json.loads(line)
+                except ValueError:
+                    row = None
+                yield line_number, row if isinstance(row, dict) else {'_invalid': 'not a JSON object'}
+
+def check_password_hash_format(password_hash):
+    """
+    Return why an imported 'method$salt$hash' value cannot be used, or None.
+    The method must be a fully specified one the password policy can verify,
+    at no less than the minimum cost.
+    """
+    if len(password_hash) > MAX_PASSWORD_HASH_LENGTH or password_hash.count('$') != 2:
+        return 'invalid password_hash'
+    method, salt, hashval = password_hash.split('$')
+    if not salt or not hashval or any(c not in string.hexdigits for c in hashval):
+        return 'invalid password_hash'
+    try:
+        if normalize_method(method) != method:
+            return 'unsupported password_hash method'
+        params = method.split(':')
+        if params[0] == 'pbkdf2':
+            hashlib.new(params[1])
+            if int(params[2]) < MIN_PBKDF2_ITERATIONS:
+                return 'weak password_hash'
+        else:
+            n, r, p = (int(value) for value in params[1:])
+            if n & (n - 1) or p < 1:
+                return 'invalid password_hash'
+            if n < MIN_SCRYPT_N or r < MIN_SCRYPT_R:
+                return 'weak password_hash'
+    except ValueError:
+        return 'unsupported password_hash method'
+    return None
+
+def normalize_row(row):
+    """
+    Validate and normalize one input row.
+    Returns (record, None) or (None, reason). A row needs a username, an
+    email and either a plaintext `password` or an existing Werkzeug-format
+    `password_hash`, which is imported as is if it passes check_password_hash_format.
+    """
+    if '_invalid' in row:
+        return None, row['_invalid']
+    username = (row.get('username') or '').strip()
+    email = (row.get('email') or '').strip()
+    password = row.get('password') or ''
+    password_hash = (row.get('password_hash') or '').strip()
+
+    if not username or not email:
+        return None, 'missing username or email'
+    if len(username) > MAX_USERNAME_LENGTH:
+        return None, 'username too long'
+    if '@' not in email:
+        return None, 'invalid email'
+    if not password and not password_hash:
+        return None, 'missing password'
+    if password_hash:
+        reason = check_password_hash_format(password_hash)
+        if reason:
+            return None, reason
+    return {'username': username, 'email': email, 'password': password, 'password_hash': password_hash}, None
+
+def prepare_chunk(records, method, salt_length):
+    """Hash passwords and encrypt emails for a chunk of normalized records; runs in a worker process"""
+    now = datetime.utcnow()
+    prepared = []
+    for line_number, record in records:
+        prepared.append((line_number, {
+            'username': record['username'],
+            'email': encrypt_data(record['email'], compact=True),
+            'email_index': email_blind_index(record['email']),
+            'password': record['password_hash'] or generate_hash(record['password'], method=method, salt_length=salt_length),
+            'registered_on': now,
+            'credential_version': 0,
+        }))
+    return prepared
+
+class DuplicateReport:
+    """Writes skipped rows to a CSV report as they are found, so nothing accumulates in memory"""
+
+    def __init__(self, path=None):
+        self.counts = {}
+        self._file = open(path, 'w', newline='', encoding='utf-8') if path else None
+        self._writer = csv.writer(self._file) if self._file else None
+        if self._writer:
+            self._writer.writerow(['line', 'username', 'reason'])
+
+    def add(self, line_number, username, reason):
+        self.counts[reason] = self.counts.get(reason, 0) + 1
+        if self._writer:
+            self._writer.writerow([line_number, username, reason])
+
+    def close(self):
+        if self._file:
+            self._file.close()
+
+def filter_duplicates(prepared, report):
+    """
+    Drop rows whose username or email already exists, in the database or earlier in the chunk.
+    Earlier chunks are committed before this runs, so the database check
+    covers duplicates anywhere earlier in the file.
+    """
+    user_table = User.__table__
+    usernames = [row['username'] for _, row in prepared]
+    indexes = [row['email_index'] for _, row in prepared]
+    taken_usernames = set(db.session.execute(
+        select(user_table.c.username).where(user_table.c.username.in_(usernames))).scalars())
+    taken_indexes = set(db.session.execute(
+        select(user_table.c.email_index).where(user_table.c.email_index.in_(indexes))).scalars())
+
+    rows = []
+    for line_number, row in prepared:
+        if row['username'] in taken_usernames:
+            report.add(line_number, row['username'], 'duplicate username')
+        elif row['email_index'] in taken_indexes:
+            report.add(line_number, row['username'], 'duplicate email')
+        else:
+            taken_usernames.add(row['username'])
+            taken_indexes.add(row['email_index'])
+            rows.append((line_number, row))
+    return rows
+
+def insert_chunk(rows, report):
+    """Insert a chunk with one executemany; fall back to row-by-row if a concurrent write collides"""
+    user_table = User.__table__
+    try:
+        db.session.execute(user_table.insert(), [row for _, row in rows])
+        # Core inserts skip the ORM signup listener, so update the rollups here
+        record_signups(db.session.connection(), [row['registered_on'] for _, row in rows])
+        db.session.commit()
+        return len(rows)
+    except IntegrityError:
+        db.session.rollback()
+
+    inserted = 0
+    for line_number, row in rows:
+        try:
+            db.session.execute(user_table.insert(), row)
+            record_signups(db.session.connection(), [row['registered_on']])
+            db.session.commit()
+            inserted += 1
+        except IntegrityError:
+            db.session.rollback()
+            report.add(line_number, row['username'], 'duplicate (concurrent insert)')
+    return inserted
+
+def prepared_chunks(records, workers, chunk_size, method, salt_length):
+    """Yield prepared chunks in input order, keeping a bounded number in flight in the process pool"""
+    chunks = iter(lambda: list(itertools.islice(records, chunk_size)), [])
+    if workers == 0:
+        for chunk in chunks:
+            yield prepare_chunk(chunk, method, salt_length)
+        return
+
+    prepare = functools.partial(prepare_chunk, method=method, salt_length=salt_length)
+    with worker_pool(workers) as executor:
+        for _, prepared in ordered_results(prepare, chunks, executor, workers * 2):
+            yield prepared
+
+def import_users(path, file_format=None, workers=None, chunk_size=500, report_path=None, dry_run=False):
+    """
+    Stream users from a CSV or JSONL file into the user table.
+
+    Rows are validated and normalized as they are read, passwords are
+    hashed under the current password policy and emails encrypted in a
+    process pool, and each chunk is inserted with a single executemany.
+    Invalid and duplicate rows are skipped and written to the report.
+    Memory use depends on chunk_size and workers, not on the file size.
+    """
+    workers = (os.cpu_count() or 1) if workers is None else workers
+    report = DuplicateReport(report_path)
+
+    def valid_records():
+        for line_number, row in read_rows(path, file_format):
+            record, reason = normalize_row(row)
+            if reason:
+                report.add(line_number, (row.get('username') or '').strip(), reason)
+            else:
+                yield line_number, record
+
+    start = time.perf_counter()
+    imported = 0
+    with app.app_context():
+        try:
+            for prepared in prepared_chunks(valid_records(), workers, chunk_size,
+                                            password_policy.method, password_policy.salt_length):
+                rows = filter_duplicates(prepared, report)
+                if rows and not dry_run:
+                    imported += insert_chunk(rows, report)
+                elif dry_run:
+                    imported += len(rows)
+                print(f"{'Validated' if dry_run else 'Imported'} {imported} user(s) "
+                      f"({imported / (time.perf_counter() - start):.0f}/sec)")
+        finally:
+            report.close()
+
+    print(f"{'Would import' if dry_run else 'Imported'} {imported} user(s) in {time.perf_counter() - start:.1f}s")
+    for reason, count in sorted(report.counts.items()):
+        print(f"Skipped {count} row(s): {reason}")
+    return imported
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bulk import users from a CSV or JSONL file")
+    parser.add_argument('path', help="CSV with a header row, or JSONL with one object per line")
+    parser.add_argument('--format', choices=['csv', 'jsonl'], default=None, help="default: from the file extension")
+    parser.add_argument('--workers', type=int, default=None, help="hashing processes (default: all cores, 0 = inline)")
+    parser.add_argument('--chunk-size', type=int, default=500, help="rows per worker task and per insert")
+    parser.add_argument('--report', default=None, help="write skipped rows to this CSV file")
+    parser.add_argument('--dry-run', action='store_true', help="validate and hash without inserting")
+    args = parser.parse_args()
+
+    import_users(args.path, file_format=args.format, workers=args.workers, chunk_size=args.chunk_size,
+                 report_path=args.report, dry_run=args.dry_run)
@@ -0,0 +1,106 @@
+import argparse
+import smtplib
+import time
+from datetime import datetime, timedelta
+from flask_mail import Message
+from app import app, db, mail, OutboxMessage
+
+MAX_ATTEMPTS = 8
+BASE_RETRY_DELAY = 30       # seconds; doubled after every failed attempt
+MAX_RETRY_DELAY = 60 * 60
+
+class OutboxDelivery:
+    """
+    Deliver queued OutboxMessages in batches over one long-lived SMTP connection.
+
+    The connection is opened on the first message and reused across
+    batches; it is dropped and reopened only after an SMTP error. Failed
+    messages are retried with exponential backoff and marked 'failed' after
+    MAX_ATTEMPTS attempts.
+    """
+
+    def __init__(self, batch_size=50):
+        self.batch_size = batch_size
+        self._connection = None
+
+    def _connect(self):
+        if self._connection is None:
+            connection = mail.connect()
+            self._connection = connection.__enter__()
+        return self._connection
+
+    def close(self):
+        """Quit the SMTP session if one is open"""
+        if self._connection is not None:
+            try:
+                self._connection.__exit__(None, None, None)
+            except Exception:
+                pass
+            self._connection = None
+
+    def _fail(self, message, error):
+        message.attempts += 1
+        message.last_error = f"{type(error).__name__}: {error}"[:255]
+        if message.attempts >= MAX_ATTEMPTS:
+            message.status = 'failed'
+        else:
+            delay = min(BASE_RETRY_DELAY * 2 ** (message.attempts - 1), MAX_RETRY_DELAY)
+            message.next_attempt_at = datetime.utcnow() + timedelta(seconds=delay)
+
+    def deliver_batch(self):
+        """Send one batch of due messages; returns how many were attempted"""
+        messages = OutboxMessage.query.filter(
+            OutboxMessage.status == 'pending',
+            OutboxMessage.next_attempt_at <= datetime.utcnow()
+        ).order_by(OutboxMessage.next_attempt_at).limit(self.batch_size).all()
+
+        for message in messages:
+            msg = Message(message.subject, sender=message.sender,
+                          recipients=str(message.recipients).split(','), body=str(message.body or ''))
+            try:
+                self._connect().send(msg)
+            except (smtplib.SMTPException, OSError) as e:
+                # The connection may be broken; reopen it for the next message
+                self.close()
+                self._fail(message, e)
+                continue
+            message.status = 'sent'
+            message.attempts += 1
+            message.sent_at = datetime.utcnow()
+            message.body = None
+            message.last_error = None
+
+        db.session.commit()
+        return len(messages)
+
+    def run(self, poll_interval=2.0, idle_disconnect=60.0):
+        """Poll the outbox forever, closing the SMTP connection after idle_disconnect seconds without mail"""
+        last_sent = time.monotonic()
+        while True:
+            with app.app_context():
+                count = self.deliver_batch()
+            if count:
+                last_sent = time.monotonic()
+                # More may be waiting; go straight to the next batch
+                if count == self.batch_size:
+                    continue
+            elif self._connection is not None and time.monotonic() - last_sent > idle_disconnect:
+                self.close()
+            time.sleep(poll_interval)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Deliver queued email from the outbox")
+    parser.add_argument('--batch-size', type=int, default=50)
+    parser.add_argument('--poll-interval', type=float, default=2.0)
+    parser.add_argument('--once', action='store_true', help="deliver one batch and exit")
+    args = parser.parse_args()
+
+    delivery = OutboxDelivery(batch_size=args.batch_size)
+    try:
+        if args.once:
+            with app.app_context():
+                print(f"Attempted delivery of {delivery.deliver_batch()} message(s)")
+        else:
+            delivery.run(poll_interval=args.poll_interval)
+    finally:
+        delivery.close()
@@ -1,48 +1,344 @@
-from app import app, User, db
-from crypto_utils import encrypt_data, decrypt_data
+from app import app, User, SignupDaily, db
+from signup_stats import rebuild_signup_rollups
+from crypto_utils import encrypt_data, decrypt_many, email_blind_index, is_compact, ordered_results, to_compact, worker_pool
+from sqlalchemy import and_, bindparam, func, inspect, select, text
+from datetime import datetime
+import argparse
+import time
 
-def migrate_user_emails():
+class MigrationCheckpoint(db.Model):
+    """Progress of one data migration, committed in the same transaction as each batch"""
+    __tablename__ = 'migration_checkpoint'
+    name = db.Column(db.String(100), primary_key=True)
+    last_id = db.Column(db.Integer, nullable=False, default=0)
+    rows_scanned = db.Column(db.Integer, nullable=False, default=0)
+    rows_updated = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, nullable=True)
+    completed_at = db.Column(db.DateTime, nullable=True)
+
+class DataMigration:
     """
-    Migration script to encrypt existing user emails.
-    Run this script after updating the User model but before using the application.
+    An online data migration over one table, run in batches by MigrationRunner.
+
+    Subclasses select the rows that still need work with pending(), compute
+    the updates for a batch in process() and apply them with the executemany
+    statement from update_statement(). process() receives plain
+    (id, *columns) tuples and may run in a worker process, so it must not
+    touch the database. Register new migrations with @register_migration.
     """
-    print("Starting migration of user email data...")
-    
-    with app.app_context():
-        # Get all users
-        users = User.query.all()
-        count = 0
-        
-        for user in users:
-            try:
-                # Try to decrypt the email to see if it's already encrypted
-                try:
-                    decrypted_test = decrypt_data(user._email)
-                    if decrypted_test is not None:
-                        # Email is already encrypted and can be decrypted
-                        print(f"Email already encrypted for user: {user.username}")
-                        continue
-                except:
-                    pass
-                
-                # If we get here, email is not encrypted yet
-                print(f"Encrypting email for user: {user.username}")
-                # Store the plain email temporarily
-                plain_email = user._email
-                # Encrypt the email and store it back
-                user._email = encrypt_data(plain_email)
-                count += 1
-                
-            except Exception as e:
-                print(f"Error processing user {user.username}: {e}")
+    name = None
+    description = ''
+    columns = ()
+
+    def table(self):
+        return User.__table__
+
+    def pending(self, table):
+        """Extra WHERE clause limiting the scan to rows that still need migrating, or None for all rows"""
+        return None
+
+    def process(self, rows):
+        """Return (updates, errors) for a batch; updates are parameter dicts, errors (id, message) pairs"""
+        raise NotImplementedError
+
+    def update_statement(self, table):
+        raise NotImplementedError
+
+MIGRATIONS = []
+
+def register_migration(migration_class):
+    """Add a DataMigration subclass to the list the runner applies, in definition order"""
+    MIGRATIONS.append(migration_class())
+    return migration_class
+
+@register_migration
+class CompactEmailStorage(DataMigration):
+    name = 'compact_email_storage'
+    description = 'encrypt plaintext emails and convert legacy base64 ciphertexts to compact binary storage'
+    columns = ('email', 'email_index')
+
+    def process(self, rows):
+        # Already-compact rows are skipped here rather than in SQL, which keeps the scan dialect-neutral
+        rows = [row for row in rows if not is_compact(row[1])]
+        updates, errors = [], []
+        plain_emails = decrypt_many([self._as_text(email) for _, email, _ in rows], errors=[], workers=0)
+        for (user_id, email, email_index), plain_email in zip(rows, plain_emails):
+            old_email, email = email, self._as_text(email)
+            if plain_email is not None:
+                # Legacy ciphertext: re-frame the token without re-encrypting
+                new_email, new_index = to_compact(email), email_index or email_blind_index(plain_email)
+            elif '@' in email:
+                # Base64 never contains '@', so this is an email stored before encryption was added
+                new_email, new_index = encrypt_data(email, compact=True), email_blind_index(email)
+            else:
+                errors.append((user_id, 'not decryptable and not a plaintext email'))
                 continue
-        
-        # Commit all changes
-        if count > 0:
+            updates.append({'user_id': user_id, 'old_email': old_email, 'new_email': new_email, 'new_index': new_index})
+        return updates, errors
+
+    @staticmethod
+    def _as_text(email):
+        """Legacy and plaintext values come back as bytes on databases that don't keep SQLite's text affinity"""
+        return bytes(email).decode('utf-8', 'replace') if isinstance(email, (bytes, memoryview)) else email
+
+    def update_statement(self, table):
+        # Compare-and-set on the old value so concurrent application writes win
+        return table.update().where(
+            table.c.id == bindparam('user_id'),
+            table.c.email == bindparam('old_email'),
+        ).values(email=bindparam('new_email'), email_index=bindparam('new_index'))
+
+@register_migration
+class BackfillEmailIndex(DataMigration):
+    name = 'backfill_email_index'
+    description = 'fill the email_index blind index for users that have none'
+    columns = ('email',)
+
+    def pending(self, table):
+        return table.c.email_index.is_(None)
+
+    def process(self, rows):
+        decrypt_errors = []
+        plain_emails = decrypt_many([email for _, email in rows], errors=decrypt_errors, workers=0)
+        updates = []
+        for (user_id, _), plain_email in zip(rows, plain_emails):
+            # Undecryptable rows get a placeholder that can never match a real lookup
+            new_index = email_blind_index(plain_email) if plain_email is not None else f"undecryptable:{user_id}"
+            updates.append({'user_id': user_id, 'new_index': new_index})
+        return updates, [(rows[index][0], message) for index, message in decrypt_errors]
+
+    def update_statement(self, table):
+        return table.update().where(
+            table.c.id == bindparam('user_id'),
+            table.c.email_index.is_(None),
+        ).values(email_index=bindparam('new_index'))
+
+class MigrationRunner:
+    """
+    Apply data migrations in keyset-paginated batches with a commit per batch.
+
+    Each batch's updates and its checkpoint are committed together, so an
+    interrupted run resumes after the last committed batch. rate caps the
+    rows scanned per second (0 = unlimited) to leave room for request
+    traffic; workers > 0 computes batches in a process pool while the main
+    process applies them in id order. dry_run computes everything and
+    reports what would change without writing.
+    """
+
+    def __init__(self, batch_size=500, rate=0, workers=0, dry_run=False):
+        self.batch_size = batch_size
+        self.rate = rate
+        self.workers = workers
+        self.dry_run = dry_run
+
+    def _checkpoint(self, name, restart):
+        checkpoint = db.session.get(MigrationCheckpoint, name)
+        if self.dry_run:
+            # A detached copy, so a dry run never writes the checkpoint
+            saved = None if restart else checkpoint
+            return MigrationCheckpoint(name=name, last_id=saved.last_id if saved else 0, rows_scanned=0,
+                                       rows_updated=0, completed_at=saved.completed_at if saved else None)
+        if checkpoint is None:
+            checkpoint = MigrationCheckpoint(name=name, last_id=0, rows_scanned=0, rows_updated=0)
+            db.session.add(checkpoint)
+        elif restart:
+            checkpoint.last_id = checkpoint.rows_scanned = checkpoint.rows_updated = 0
+            checkpoint.completed_at = None
+        return checkpoint
+
+    def _fetch_batches(self, migration, table, after_id):
+        clauses = [table.c.id > after_id]
+        pending = migration.pending(table)
+        if pending is not None:
+            clauses.append(pending)
+        query = select(table.c.id, *(table.c[column] for column in migration.columns))
+        while True:
+            rows = [tuple(row) for row in db.session.execute(
+                query.where(and_(*clauses)).order_by(table.c.id).limit(self.batch_size))]
+            if not rows:
+                return
+            yield rows
+            clauses[0] = table.c.id > rows[-1][0]
+
+    def _processed_batches(self, migration, table, after_id):
+        """Yield (rows, (updates, errors)) in id order, computing up to `workers` batches ahead"""
+        batches = self._fetch_batches(migration, table, after_id)
+        if not self.workers:
+            for rows in batches:
+                yield rows, migration.process(rows)
+            return
+
+        with worker_pool(self.workers) as executor:
+            yield from ordered_results(migration.process, batches, executor, self.workers)
+
+    def run(self, migration, restart=False):
+        """Run one migration from its checkpoint; returns (rows scanned, rows updated) for this run"""
+        table = migration.table()
+        checkpoint = self._checkpoint(migration.name, restart)
+        if checkpoint.completed_at:
+            print(f"{migration.name}: already completed at {checkpoint.completed_at:%Y-%m-%d %H:%M:%S}")
+            db.session.rollback()
+            return 0, 0
+        if not self.dry_run:
             db.session.commit()
-            print(f"Successfully encrypted {count} user email(s)")
-        else:
-            print("No emails needed encryption")
+
+        prefix = f"{migration.name}{' (dry run)' if self.dry_run else ''}"
+        print(f"{prefix}: {migration.description}, resuming after id {checkpoint.last_id}")
+        statement = migration.update_statement(table)
+        start = time.perf_counter()
+        scanned = updated = 0
+        for rows, (updates, errors) in self._processed_batches(migration, table, checkpoint.last_id):
+            scanned += len(rows)
+            updated += len(updates)
+            if self.dry_run:
+                db.session.rollback()
+            else:
+                if updates:
+                    db.session.execute(statement, updates)
+                checkpoint.last_id = rows[-1][0]
+                checkpoint.rows_scanned += len(rows)
+                checkpoint.rows_updated += len(updates)
+                checkpoint.updated_at = datetime.utcnow()
+                db.session.commit()
+
+            elapsed = time.perf_counter() - start
+            print(f"{prefix}: {scanned} row(s) scanned, {updated} {'to update' if self.dry_run else 'updated'} "
+                  f"({scanned / elapsed:.0f} rows/sec)")
+            if errors:
+                print(f"{prefix}: {len(errors)} row(s) failed in batch, ids {[row_id for row_id, _ in errors][:10]}")
+            if self.rate:
+                # Sleep off any time we are ahead of the target rate
+                time.sleep(max(0.0, scanned / self.rate - elapsed))
+
+        if not self.dry_run:
+            checkpoint.completed_at = datetime.utcnow()
+            db.session.commit()
+        print(f"{prefix}: done, {scanned} row(s) scanned, {updated} {'to update' if self.dry_run else 'updated'}")
+        return scanned, updated
+
+def _add_column(table, column_name, ddl_type):
+    """Add a column to an existing table unless it is already there, quoting identifiers for the dialect"""
+    columns = [column['name'] for column in inspect(db.engine).get_columns(table.name)]
+    if column_name in columns:
+        return
+    print(f"Adding {column_name} column to {table.name} table")
+    quote = db.engine.dialect.identifier_preparer.quote
+    db.session.execute(text(f'ALTER TABLE {quote(table.name)} ADD COLUMN {quote(column_name)} {ddl_type}'))
+    db.session.commit()
+
+def add_email_index_column():
+    """
+    Add the email_index blind-index column to an existing user table.
+    db.create_all() does not add columns to tables that already exist.
+    """
+    with app.app_context():
+        user_table = User.__table__
+        _add_column(user_table, 'email_index', user_table.c.email_index.type.compile(dialect=db.engine.dialect))
+        for index in user_table.indexes:
+            if index.name == 'ix_user_email_index':
+                index.create(db.engine, checkfirst=True)
+
+def add_credential_version_column():
+    """Add the credential_version column used to invalidate identity claims to an existing user table"""
+    with app.app_context():
+        _add_column(User.__table__, 'credential_version', 'INTEGER NOT NULL DEFAULT 0')
+
+def pending_schema_changes():
+    """Describe the schema changes apply_schema_changes would make, without making them"""
+    with app.app_context():
+        inspector = inspect(db.engine)
+        tables = set(inspector.get_table_names())
+        changes = [f"create table {name}" for name in db.metadata.tables if name not in tables]
+        user_table = User.__table__
+        if user_table.name in tables:
+            columns = {column['name'] for column in inspector.get_columns(user_table.name)}
+            changes += [f"add column {user_table.name}.{name}" for name in ('email_index', 'credential_version')
+                        if name not in columns]
+            if 'ix_user_email_index' not in {index['name'] for index in inspector.get_indexes(user_table.name)}:
+                changes.append("create index ix_user_email_index")
+    return changes
+
+def signup_rollup_drift():
+    """How many users the signup rollups are missing (negative if they count more users than exist)"""
+    with app.app_context():
+        users = db.session.execute(select(func.count()).select_from(User.__table__)).scalar()
+        counted = 0
+        if inspect(db.engine).has_table(SignupDaily.__tablename__):
+            counted = db.session.execute(select(func.coalesce(func.sum(SignupDaily.__table__.c.signups), 0))).scalar()
+        db.session.rollback()
+    return users - counted
+
+def report_pending_upgrade():
+    """Print what apply_schema_changes would do; returns the pending schema changes"""
+    changes = pending_schema_changes()
+    for change in changes:
+        print(f"Pending schema change: {change}")
+    drift = signup_rollup_drift()
+    if drift:
+        print(f"Pending: rebuild signup rollups ({drift:+d} user(s) compared with the user table)")
+    return changes
+
+def apply_schema_changes():
+    """Schema changes the data migrations depend on; each is a quick no-op once applied"""
+    with app.app_context():
+        # Tables added since the database was created (outbox, signup rollups, security events, checkpoints)
+        existing = set(inspect(db.engine).get_table_names())
+        db.metadata.create_all(db.engine, checkfirst=True)
+        created = sorted(set(db.metadata.tables) - existing)
+        if created:
+            print(f"Created table(s): {', '.join(created)}")
+    add_email_index_column()
+    add_credential_version_column()
+    if signup_rollup_drift():
+        # Rollups created empty (here or by db.create_all()) don't count users registered before them
+        rebuild_signup_rollups()
+
+def run_migrations(names=None, batch_size=500, rate=0, workers=0, dry_run=False, restart=False):
+    """Apply the named migrations (default: all registered, in order)"""
+    by_name = {migration.name: migration for migration in MIGRATIONS}
+    unknown = [name for name in names or [] if name not in by_name]
+    if unknown:
+        raise SystemExit(f"Unknown migration(s): {', '.join(unknown)}")
+
+    if dry_run:
+        if report_pending_upgrade():
+            print("Dry run: data migrations can be previewed once the schema changes are applied")
+            return
+    else:
+        apply_schema_changes()
+    runner = MigrationRunner(batch_size=batch_size, rate=rate, workers=workers, dry_run=dry_run)
+    with app.app_context():
+        for migration in [by_name[name] for name in names] if names else MIGRATIONS:
+            runner.run(migration, restart=restart)
+
+def list_migrations():
+    """Show pending schema changes and each migration's progress without changing anything"""
+    report_pending_upgrade()
+    with app.app_context():
+        has_checkpoints = inspect(db.engine).has_table(MigrationCheckpoint.__tablename__)
+        for migration in MIGRATIONS:
+            checkpoint = db.session.get(MigrationCheckpoint, migration.name) if has_checkpoints else None
+            if checkpoint is None:
+                status = 'not started'
+            elif checkpoint.completed_at:
+                status = f"completed {checkpoint.completed_at:%Y-%m-%d %H:%M:%S}, {checkpoint.rows_updated} row(s) updated"
+            else:
+                status = f"in progress after id {checkpoint.last_id}, {checkpoint.rows_updated} row(s) updated"
+            print(f"{migration.name:<24} {status}")
 
 if __name__ == "__main__":
-    migrate_user_emails() 
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Run resumable online data migrations")
+    parser.add_argument('migrations', nargs='*', help="migrations to run (default: all, in order)")
+    parser.add_argument('--list', action='store_true', help="show registered migrations and their progress")
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--rate', type=float, default=0, help="maximum rows scanned per second (0 = unlimited)")
+    parser.add_argument('--workers', type=int, default=0, help="processes computing batches ahead (0 = inline)")
+    parser.add_argument('--dry-run', action='store_true', help="report what would change without writing")
+    parser.add_argument('--restart', action='store_true', help="ignore saved checkpoints and start from the first row")
+    args = parser.parse_args()
+
+    if args.list:
+        list_migrations()
+    else:
+        run_migrations(args.migrations, batch_size=args.batch_size, rate=args.rate, workers=args.workers,
+                       dry_run=args.dry_run, restart=args.restart)
@@ -0,0 +1,171 @@
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from password_policy import generate_hash, check_hash
+
+class HashingBusy(Exception):
+    """Raised when the hashing pool is saturated and the request should be rejected"""
+
+def _timed_call(func, args, kwargs):
+    """Run func in a worker process and report when it started and finished"""
+    started = time.time()
+    result = func(*args, **kwargs)
+    return result, started, time.time()
+
+class HashingService:
+    """
+    Run password hashing on a bounded process pool instead of the request thread.
+
+    At most `workers` hashes run at once and at most `max_queue` more may
+    wait for a worker. Anything beyond that raises HashingBusy immediately
+    so the caller can answer 503 rather than queueing behind an attack.
+    workers=0 hashes inline on each calling thread with no queue limit
+    (useful for development).
+    """
+
+    def __init__(self, workers=None, max_queue=None, timeout=30.0):
+        self.workers = (os.cpu_count() or 1) if workers is None else workers
+        self.max_queue = self.workers * 4 if max_queue is None else max_queue
+        self.timeout = timeout
+        self._executor = None
+        self._executor_pid = None
+        # Inline hashing runs on the request threads themselves, so there is no pool to protect
+        self._slots = threading.BoundedSemaphore(self.workers + self.max_queue) if self.workers else None
+        self._lock = threading.Lock()
+        self._stats = {
+            'submitted': 0,
+            'rejected': 0,
+            'completed': 0,
+            'failed': 0,
+            'pool_restarts': 0,
+            'timeouts': 0,
+            'in_flight': 0,
+            'queue_wait_total': 0.0,
+            'queue_wait_max': 0.0,
+            'hash_time_total': 0.0,
+            'hash_time_max': 0.0,
+        }
+
+    def _get_executor(self):
+        """Create the pool lazily, and again after a fork, so prefork servers get one pool per worker"""
+        if self._executor is None or self._executor_pid != os.getpid():
+            with self._lock:
+                if self._executor is None or self._executor_pid != os.getpid():
+                    self._executor = ProcessPoolExecutor(max_workers=self.workers)
+                    self._executor_pid = os.getpid()
+        return self._executor
+
+    def _discard_executor(self, executor):
+        """Drop a broken pool (e.g. after a worker was killed) so the next call creates a new one"""
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+                self._stats['pool_restarts'] += 1
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def _acquire_slot(self):
+        """Take a queue slot or raise HashingBusy"""
+        if self._slots is not None and not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._stats['rejected'] += 1
+            raise HashingBusy("Password hashing queue is full")
+        with self._lock:
+            self._stats['in_flight'] += 1
+
+    def _release_slot(self, future=None):
+        with self._lock:
+            self._stats['in_flight'] -= 1
+        if self._slots is not None:
+            self._slots.release()
+
+    def _submit(self, func, args, kwargs):
+        """
+        Run func on the pool while holding a slot, replacing a broken pool and retrying once.
+        The slot is released when the worker finishes rather than when the caller stops
+        waiting, so hashes that outlive the timeout still count against the queue limit.
+        """
+        for attempt in range(2):
+            if attempt:
+                self._acquire_slot()
+            executor = self._get_executor()
+            try:
+                future = executor.submit(_timed_call, func, args, kwargs)
+            except (BrokenProcessPool, RuntimeError):
+                # Broken, or shut down by another thread that found it broken
+                self._release_slot()
+                self._discard_executor(executor)
+                if attempt:
+                    raise HashingBusy("Password hashing pool failed")
+                continue
+            future.add_done_callback(self._release_slot)
+            try:
+                return future.result(timeout=self.timeout)
+            except FutureTimeoutError:
+                future.cancel()
+                with self._lock:
+                    self._stats['timeouts'] += 1
+                raise HashingBusy("Password hashing timed out")
+            except BrokenProcessPool:
+                self._discard_executor(executor)
+                if attempt:
+                    raise HashingBusy("Password hashing pool failed")
+
+    def _record(self, key, value):
+        self._stats[key + '_total'] += value
+        self._stats[key + '_max'] = max(self._stats[key + '_max'], value)
+
+    def _run(self, func, *args, **kwargs):
+        """Run func on the pool, enforcing the queue limit and recording timings"""
+        self._acquire_slot()
+        with self._lock:
+            self._stats['submitted'] += 1
+        submitted = time.time()
+        try:
+            if self.workers == 0:
+                try:
+                    result, started, finished = _timed_call(func, args, kwargs)
+                finally:
+                    self._release_slot()
+            else:
+                result, started, finished = self._submit(func, args, kwargs)
+        except Exception:
+            with self._lock:
+                self._stats['failed'] += 1
+            raise
+
+        with self._lock:
+            self._stats['completed'] += 1
+            self._record('queue_wait', max(started - submitted, 0.0))
+            self._record('hash_time', finished - started)
+        return result
+
+    def generate(self, password, method='pbkdf2:sha256', salt_length=16):
+        """Hash a password on the pool; see password_policy.generate_hash"""
+        return self._run(generate_hash, password, method=method, salt_length=salt_length)
+
+    def check(self, pwhash, password):
+        """Verify a password on the pool; see password_policy.check_hash"""
+        return self._run(check_hash, pwhash, password)
+
+    def stats(self):
+        """Return a snapshot of the pool counters, with mean timings in milliseconds"""
+        with self._lock:
+            stats = dict(self._stats)
+        completed = stats['completed'] or 1
+        return {
+            'workers': self.workers,
+            'max_queue': self.max_queue,
+            'submitted': stats['submitted'],
+            'rejected': stats['rejected'],
+            'completed': stats['completed'],
+            'failed': stats['failed'],
+            'pool_restarts': stats['pool_restarts'],
+            'timeouts': stats['timeouts'],
+            'in_flight': stats['in_flight'],
+            'queue_wait_ms_mean': stats['queue_wait_total'] / completed * 1000,
+            'queue_wait_ms_max': stats['queue_wait_max'] * 1000,
+            'hash_time_ms_mean': stats['hash_time_total'] / completed * 1000,
+            'hash_time_ms_max': stats['hash_time_max'] * 1000,
+        }
@@ -0,0 +1,64 @@
+import hashlib
+import hmac
+from werkzeug.security import generate_password_hash, check_password_hash, gen_salt, DEFAULT_PBKDF2_ITERATIONS
+
+# Same defaults as Werkzeug 3's scrypt support, so hashes stay compatible after an upgrade
+DEFAULT_SCRYPT_N = 2 ** 15
+DEFAULT_SCRYPT_R = 8
+DEFAULT_SCRYPT_P = 1
+
+def normalize_method(method):
+    """Expand a hash method to the fully specified form stored in hashes, e.g. 'pbkdf2:sha256:260000'"""
+    parts = method.split(':')
+    if parts[0] == 'pbkdf2':
+        digest = parts[1] if len(parts) > 1 and parts[1] else 'sha256'
+        iterations = int(parts[2]) if len(parts) > 2 and parts[2] else DEFAULT_PBKDF2_ITERATIONS
+        return f"pbkdf2:{digest}:{iterations}"
+    if parts[0] == 'scrypt':
+        n = int(parts[1]) if len(parts) > 1 and parts[1] else DEFAULT_SCRYPT_N
+        r = int(parts[2]) if len(parts) > 2 and parts[2] else DEFAULT_SCRYPT_R
+        p = int(parts[3]) if len(parts) > 3 and parts[3] else DEFAULT_SCRYPT_P
+        return f"scrypt:{n}:{r}:{p}"
+    raise ValueError(f"Unsupported password hash method: {method}")
+
+def _scrypt_hex(password, salt, method):
+    """Compute the hex scrypt digest for a normalized 'scrypt:n:r:p' method"""
+    n, r, p = (int(value) for value in method.split(':')[1:])
+    return hashlib.scrypt(
+        password.encode('utf-8'), salt=salt.encode('utf-8'),
+        n=n, r=r, p=p, maxmem=132 * n * r * p
+    ).hex()
+
+def generate_hash(password, method='pbkdf2:sha256', salt_length=16):
+    """Hash a password as 'method$salt$hash' using PBKDF2 (via Werkzeug) or scrypt (via hashlib)"""
+    method = normalize_method(method)
+    if method.startswith('scrypt:'):
+        salt = gen_salt(salt_length)
+        return f"{method}${salt}${_scrypt_hex(password, salt, method)}"
+    return generate_password_hash(password, method=method, salt_length=salt_length)
+
+def check_hash(pwhash, password):
+    """Check a password against a hash produced by generate_hash or generate_password_hash"""
+    if pwhash.startswith('scrypt:'):
+        try:
+            method, salt, expected = pwhash.split('$', 2)
+            return hmac.compare_digest(_scrypt_hex(password, salt, method), expected)
+        except ValueError:
+            return False
+    return check_password_hash(pwhash, password)
+
+class PasswordPolicy:
+    """
+    The password hashing algorithm and cost parameters new hashes should use.
+
+    Hashes made under an older policy keep verifying; needs_rehash tells
+    the login path when a stored hash should be upgraded to this policy.
+    """
+
+    def __init__(self, method='pbkdf2:sha256', salt_length=16):
+        self.method = normalize_method(method)
+        self.salt_length = salt_length
+
+    def needs_rehash(self, pwhash):
+        """Return True if pwhash was made with a different algorithm or cost than the policy"""
+        return pwhash.split('$', 1)[0] != self.method
@@ -0,0 +1,109 @@
+import argparse
+import os
+import threading
+import time
+from sqlalchemy import bindparam
+from app import app, User, db
+from crypto_utils import KEY_FILE, export_index_key, get_keys, key_reload_interval, needs_rotation, promote_key, rotate_data, stage_key
+
+def sweep_stale_emails(batch_size=200, pause=0.5):
+    """
+    Re-encrypt every email still encrypted with an older key.
+    Rows are processed in keyset-paginated batches with a commit per batch,
+    sleeping `pause` seconds between batches to stay out of the way of
+    request traffic. Rows already rotated on read are skipped cheaply.
+    """
+    print(f"Starting key rotation sweep ({len(get_keys())} key(s) in ring)...")
+
+    user_table = User.__table__
+    statement = user_table.update().where(
+        user_table.c.id == bindparam('user_id'),
+        user_table.c.email == bindparam('old_email'),
+    ).values(email=bindparam('new_email'))
+
+    with app.app_context():
+        count = 0
+        errors = 0
+        last_id = 0
+        while True:
+            rows = db.session.query(User.id, User._email).filter(
+                User.id > last_id
+            ).order_by(User.id).limit(batch_size).all()
+            if not rows:
+                break
+
+            updates = []
+            for user_id, encrypted_email in rows:
+                try:
+                    if needs_rotation(encrypted_email):
+                        updates.append({
+                            'user_id': user_id,
+                            'old_email': encrypted_email,
+                            'new_email': rotate_data(encrypted_email),
+                        })
+                except Exception:
+                    errors += 1
+
+            if updates:
+                # Compare-and-set on the old ciphertext so concurrent writes win
+                db.session.execute(statement, updates)
+                db.session.commit()
+                count += len(updates)
+
+            last_id = rows[-1][0]
+            if pause:
+                time.sleep(pause)
+
+        print(f"Re-encrypted {count} email(s) under the primary key")
+        if errors:
+            print(f"Could not process {errors} email(s)")
+
+def start_sweeper(batch_size=200, pause=0.5):
+    """Run the sweep on a low-priority daemon thread inside the application process"""
+    thread = threading.Thread(
+        target=sweep_stale_emails,
+        kwargs={'batch_size': batch_size, 'pause': pause},
+        name='key-rotation-sweeper',
+        daemon=True,
+    )
+    thread.start()
+    return thread
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rotate the user data encryption key in two phases")
+    parser.add_argument('--stage-key', action='store_true',
+                        help="phase 1: add a new decrypt-only key to the key file and exit")
+    parser.add_argument('--promote', action='store_true',
+                        help="phase 2: make the staged key primary, then sweep")
+    parser.add_argument('--force', action='store_true',
+                        help="promote even if running processes may not have reloaded the key file yet")
+    parser.add_argument('--export-index-key', action='store_true',
+                        help="print the current blind-index key for USER_DATA_INDEX_KEY and exit")
+    parser.add_argument('--batch-size', type=int, default=200)
+    parser.add_argument('--pause', type=float, default=0.5, help="seconds to sleep between batches")
+    args = parser.parse_args()
+
+    if args.export_index_key:
+        print(export_index_key())
+        raise SystemExit(0)
+
+    if args.stage_key:
+        stage_key()
+        print(f"Running processes reload {KEY_FILE} within {key_reload_interval():.0f}s. "
+              f"Restart any process on another host with its own copy, then run with --promote.")
+        raise SystemExit(0)
+
+    if args.promote:
+        # Every process must be able to decrypt with the new key before anything is encrypted with it
+        age = time.time() - os.stat(KEY_FILE).st_mtime
+        if age < 2 * key_reload_interval() and not args.force:
+            raise SystemExit(f"{KEY_FILE} changed {age:.0f}s ago; wait until running processes have "
+                             f"reloaded it ({2 * key_reload_interval():.0f}s) or pass --force")
+        promote_key()
+        # Give running processes time to start encrypting with the new primary before sweeping
+        time.sleep(key_reload_interval())
+
+    # Lower our CPU priority so the sweep yields to the web workers
+    if hasattr(os, 'nice'):
+        os.nice(10)
+    sweep_stale_emails(batch_size=args.batch_size, pause=args.pause)
@@ -0,0 +1,69 @@
+import argparse
+from sqlalchemy import select
+from app import app, db, User, SignupDaily, SignupHourly, record_signups
+
+def rebuild_signup_rollups(batch_size=5000):
+    """
+    Recompute the daily and hourly signup rollups from the user table.
+
+    registered_on is scanned in keyset-paginated batches and counted in
+    memory per hour, so memory grows with the number of hours covered, not
+    with the number of users. The rollups are then replaced in a single
+    transaction that also counts users who registered during the scan.
+    """
+    print("Rebuilding signup rollups...")
+    user_table = User.__table__
+
+    with app.app_context():
+        SignupDaily.__table__.create(db.engine, checkfirst=True)
+        SignupHourly.__table__.create(db.engine, checkfirst=True)
+
+        hourly = {}
+        scanned = 0
+        last_id = 0
+        while True:
+            rows = db.session.execute(
+                select(user_table.c.id, user_table.c.registered_on)
+                .where(user_table.c.id > last_id).order_by(user_table.c.id).limit(batch_size)
+            ).all()
+            db.session.rollback()
+            if not rows:
+                break
+            for _, registered_on in rows:
+                hour = registered_on.replace(minute=0, second=0, microsecond=0)
+                hourly[hour] = hourly.get(hour, 0) + 1
+            scanned += len(rows)
+            last_id = rows[-1][0]
+
+        connection = db.session.connection()
+        connection.execute(SignupDaily.__table__.delete())
+        connection.execute(SignupHourly.__table__.delete())
+        # Signups committed during the scan already bumped the rows just deleted, so count them again
+        late = db.session.execute(
+            select(user_table.c.registered_on).where(user_table.c.id > last_id)
+        ).scalars().all()
+
+        daily = {}
+        for hour, count in hourly.items():
+            daily[hour.date()] = daily.get(hour.date(), 0) + count
+        if daily:
+            connection.execute(SignupDaily.__table__.insert(),
+                               [{'day': day, 'signups': count} for day, count in daily.items()])
+            connection.execute(SignupHourly.__table__.insert(),
+                               [{'hour': hour, 'signups': count} for hour, count in hourly.items()])
+        if late:
+            record_signups(connection, late)
+        db.session.commit()
+
+        print(f"Counted {scanned + len(late)} user(s) into {len(daily)} day(s) and {len(hourly)} hour(s)")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Maintain the signup statistics rollups")
+    parser.add_argument('--rebuild', action='store_true', help="recompute the rollups from the user table")
+    parser.add_argument('--batch-size', type=int, default=5000)
+    args = parser.parse_args()
+
+    if args.rebuild:
+        rebuild_signup_rollups(batch_size=args.batch_size)
+    else:
+        parser.print_help()
@@ -0,0 +1,27 @@
+from sqlalchemy import event
+
+# Settings for SQLite under several concurrent workers:
+# - WAL lets readers proceed while one writer commits, instead of locking the whole file
+# - synchronous=NORMAL is durable in WAL mode except for the last commits on power loss
+# - busy_timeout makes writers wait for the lock instead of failing with "database is locked"
+SQLITE_PRODUCTION_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,           # milliseconds
+    'mmap_size': 256 * 1024 * 1024, # bytes of the file read through memory mapping
+    'cache_size': -64000,           # negative values are KiB, so ~64 MB of page cache per connection
+    'temp_store': 'MEMORY',
+}
+
+def apply_sqlite_profile(engine, pragmas=None):
+    """Run the given PRAGMAs on every new connection of a SQLite engine; other engines are left alone"""
+    if engine.dialect.name != 'sqlite':
+        return
+    pragmas = SQLITE_PRODUCTION_PRAGMAS if pragmas is None else pragmas
+
+    @event.listens_for(engine, 'connect')
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name}={value}')
+        cursor.close()
@@ -0,0 +1,206 @@
+import math
+import os
+import sqlite3
+import threading
+import time
+
+def _new_record(now):
+    return {'window_start': now, 'count': 0, 'prev_count': 0, 'strikes': 0, 'blocked_until': 0.0, 'last_block': 0.0}
+
+class MemoryThrottleStore:
+    """Per-process throttle records kept in a dict; fastest, but each worker counts separately"""
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._records = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        return self._records.get(key)
+
+    def update(self, key, func):
+        """Atomically replace the record for key with func(record or None)"""
+        with self._lock:
+            record = func(self._records.get(key))
+            self._records[key] = record
+            if len(self._records) > self.max_keys:
+                self._prune()
+            return record
+
+    def delete(self, key):
+        with self._lock:
+            self._records.pop(key, None)
+
+    def prune(self, now, window_before, block_before):
+        """Delete records that are unblocked, outside both windows and past strike decay"""
+        with self._lock:
+            stale = [key for key, record in self._records.items()
+                     if record['blocked_until'] < now and record['window_start'] < window_before
+                     and record['last_block'] < block_before]
+            for key in stale:
+                del self._records[key]
+            return len(stale)
+
+    def _prune(self):
+        """Drop records that are neither blocked nor counting, then the oldest if still too many"""
+        now = time.time()
+        for key in [key for key, record in self._records.items() if record['blocked_until'] < now and record['count'] == 0]:
+            del self._records[key]
+        if len(self._records) > self.max_keys:
+            oldest = sorted(self._records, key=lambda key: self._records[key]['window_start'])
+            for key in oldest[:len(self._records) - self.max_keys]:
+                del self._records[key]
+
+class SQLiteThrottleStore:
+    """Throttle records in a shared SQLite file so all workers on a host see the same counters"""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        connection = self._connection()
+        connection.execute(
+            'CREATE TABLE IF NOT EXISTS login_throttle ('
+            'key TEXT PRIMARY KEY, window_start REAL, count INTEGER, prev_count INTEGER, '
+            'strikes INTEGER, blocked_until REAL, last_block REAL)'
+        )
+
+    def _connection(self):
+        """One connection per thread; WAL lets readers check blocks while another worker writes"""
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+        return connection
+
+    _COLUMNS = ('window_start', 'count', 'prev_count', 'strikes', 'blocked_until', 'last_block')
+
+    def get(self, key):
+        row = self._connection().execute(
+            'SELECT window_start, count, prev_count, strikes, blocked_until, last_block FROM login_throttle WHERE key = ?',
+            (key,)
+        ).fetchone()
+        return dict(zip(self._COLUMNS, row)) if row else None
+
+    def update(self, key, func):
+        """Atomically replace the record for key with func(record or None)"""
+        connection = self._connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            record = func(self.get(key))
+            connection.execute(
+                'INSERT OR REPLACE INTO login_throttle (key, window_start, count, prev_count, strikes, blocked_until, last_block) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (key,) + tuple(record[column] for column in self._COLUMNS)
+            )
+            connection.execute('COMMIT')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+        return record
+
+    def delete(self, key):
+        self._connection().execute('DELETE FROM login_throttle WHERE key = ?', (key,))
+
+    def prune(self, now, window_before, block_before):
+        """Delete records that are unblocked, outside both windows and past strike decay"""
+        cursor = self._connection().execute(
+            'DELETE FROM login_throttle WHERE blocked_until < ? AND window_start < ? AND last_block < ?',
+            (now, window_before, block_before)
+        )
+        return cursor.rowcount
+
+class LoginThrottle:
+    """
+    Sliding-window failure counters per username and per client IP with exponential backoff.
+
+    Each key counts failures in a sliding window approximated from the
+    current and previous fixed windows, which needs constant memory per key.
+    When the count reaches max_attempts the key is blocked for base_delay
+    seconds, doubling with every further block up to max_delay. check() only
+    reads the block state, so throttled attempts are rejected before any
+    user lookup or password hash runs. Every prune_every failures, records
+    that no longer affect any decision are deleted from the store, so
+    failures against random usernames can't grow it without bound.
+    """
+
+    def __init__(self, store, max_attempts=5, window=300, base_delay=1.0, max_delay=900.0,
+                 max_attempts_per_ip=50, prune_every=1000):
+        self.store = store
+        self.prune_every = prune_every
+        self._failures_since_prune = 0
+        self._prune_lock = threading.Lock()
+        self.max_attempts = max_attempts
+        self.max_attempts_per_ip = max_attempts_per_ip
+        self.window = window
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def _keys(self, identifier, ip):
+        keys = []
+        if identifier:
+            keys.append(('user:' + identifier.strip().lower(), self.max_attempts))
+        if ip:
+            keys.append(('ip:' + ip, self.max_attempts_per_ip))
+        return keys
+
+    def check(self, identifier, ip):
+        """Return the seconds until a login attempt is allowed, or 0 if it may proceed"""
+        now = time.time()
+        retry_after = 0.0
+        for key, _ in self._keys(identifier, ip):
+            record = self.store.get(key)
+            if record and record['blocked_until'] > now:
+                retry_after = max(retry_after, record['blocked_until'] - now)
+        return math.ceil(retry_after)
+
+    def _failure(self, limit, now):
+        def apply(record):
+            record = dict(record) if record else _new_record(now)
+            elapsed = now - record['window_start']
+            if elapsed >= self.window:
+                # Roll the window; the old count only matters if it was the window just before
+                record['prev_count'] = record['count'] if elapsed < 2 * self.window else 0
+                record['count'] = 0
+                record['window_start'] = now - (elapsed % self.window)
+                elapsed = now - record['window_start']
+            record['count'] += 1
+
+            weight = 1 - elapsed / self.window
+            estimate = record['prev_count'] * weight + record['count']
+            if estimate >= limit and record['blocked_until'] <= now:
+                # Strikes decay once a key has been quiet for max_delay
+                if now - record['last_block'] > self.max_delay:
+                    record['strikes'] = 0
+                record['strikes'] += 1
+                delay = min(self.base_delay * 2 ** (record['strikes'] - 1), self.max_delay)
+                record['blocked_until'] = now + delay
+                record['last_block'] = now
+            return record
+        return apply
+
+    def record_failure(self, identifier, ip):
+        """Count a failed attempt and block keys that went over their limit"""
+        now = time.time()
+        for key, limit in self._keys(identifier, ip):
+            self.store.update(key, self._failure(limit, now))
+        with self._prune_lock:
+            self._failures_since_prune += 1
+            due = self._failures_since_prune >= self.prune_every
+            if due:
+                self._failures_since_prune = 0
+        if due:
+            self.prune(now)
+
+    def prune(self, now=None):
+        """Delete records that are unblocked, past the previous window and past strike decay"""
+        now = time.time() if now is None else now
+        return self.store.prune(now, now - 2 * self.window, now - self.max_delay)
+
+    def record_success(self, identifier, ip):
+        """Clear the account's counters after a successful login; the IP keeps its history"""
+        if identifier:
+            self.store.delete('user:' + identifier.strip().lower())
@@ -0,0 +1,107 @@
+import atexit
+import threading
+import time
+from collections import deque
+
+class WriteBehindBuffer:
+    """
+    Collect items in memory and hand them to a flush function in batches.
+
+    A batch is flushed when batch_size items are pending or when the oldest
+    pending item is older than interval seconds, whichever comes first.
+    Flushing runs on a daemon thread so callers never wait on the database,
+    and anything still pending is flushed at interpreter exit. Items from a
+    failed flush are kept and retried with the next batch.
+    """
+
+    def __init__(self, flush_func, batch_size=100, interval=5.0, max_pending=10000, name='write-behind'):
+        self.flush_func = flush_func
+        self.batch_size = batch_size
+        self.interval = interval
+        # Pending items form a ring: beyond max_pending the oldest are dropped,
+        # so a stuck flush can't grow memory without bound
+        self.max_pending = max_pending
+        self.name = name
+        self.dropped = 0
+        self.flushed = 0
+        self._items = deque(maxlen=max_pending)
+        self._oldest = None
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        atexit.register(self.flush)
+
+    def add(self, item):
+        """Queue an item for the next batch"""
+        with self._lock:
+            if not self._items:
+                self._oldest = time.monotonic()
+            if len(self._items) == self.max_pending:
+                self.dropped += 1
+            self._items.append(item)
+            full = len(self._items) >= self.batch_size
+        self._ensure_thread()
+        if full:
+            self._wakeup.set()
+
+    def pending(self):
+        """Return the number of items waiting to be flushed"""
+        with self._lock:
+            return len(self._items)
+
+    def pending_items(self):
+        """Return a copy of the items waiting to be flushed, oldest first"""
+        with self._lock:
+            return list(self._items)
+
+    def flush(self):
+        """Flush all pending items now on the calling thread"""
+        with self._lock:
+            items = list(self._items)
+            self._items.clear()
+            self._oldest = None
+        if not items:
+            return 0
+        try:
+            self.flush_func(items)
+        except Exception as e:
+            print(f"Error flushing {self.name} buffer, will retry {len(items)} item(s): {e}")
+            self._requeue(items)
+            return 0
+        self.flushed += len(items)
+        return len(items)
+
+    def _requeue(self, items):
+        """Put items from a failed flush back in front of newer ones; the ring drops the oldest if full"""
+        with self._lock:
+            newer = list(self._items)
+            combined = items + newer
+            overflow = max(len(combined) - self.max_pending, 0)
+            self.dropped += overflow
+            self._items.clear()
+            self._items.extend(combined[overflow:])
+            # Due again after one interval, so a failing database isn't retried in a tight loop
+            self._oldest = time.monotonic()
+
+    def _ensure_thread(self):
+        """Start the background flush thread on first use"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        """Background loop flushing on size or age"""
+        while True:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            with self._lock:
+                due = bool(self._items) and (
+                    len(self._items) >= self.batch_size
+                    or time.monotonic() - self._oldest >= self.interval
+                )
+            if due:
+                self.flush()